@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+'''
+Generate every archive output for an issue in a single pass.
+
+Each content file is loaded once and handed to the web, supernotes and
+image-list generators in turn, instead of running web_format.py,
+supernotes_format.py and grab_supernote_images.py separately.
+
+With --batch or --batch-directory, many issues are archived by one
+long-lived pool of worker processes, each of which keeps its markdown
+converter and caches warm across every file it is given.
+'''
+
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+
+import grab_supernote_images
+import content_file
+import instrumentation
+import rendering
+import supernotes_format
+import web_format
+from content_file import content_paths, load
+from instrumentation import profiler
+
+
+def archive_file(file, volume, number, directory='.',
+                 web=True, supernotes=True, images=True,
+                 consolidate_maps=False, table_page_rows=None):
+    '''
+    Run the enabled generators over one parsed content file.
+
+    Returns (paths written, supernote image records, warnings, link
+    index entry or None).
+    '''
+    outputs = []
+    images_found = []
+    warnings = []
+    index_entry = None
+
+    if web:
+        article = web_format.Article(file, volume, number, consolidate_maps,
+                                     table_page_rows)
+        outputs.extend(article.output(directory))
+        warnings.extend(article.warnings())
+        index_entry = article.index_entry()
+
+    if 'supernotes' in file.content:
+        if supernotes:
+            with profiler.stage('SupernotesCollection.__init__'):
+                collection = supernotes_format.SupernotesCollection(
+                    file, volume, number, consolidate_maps)
+            with profiler.stage('SupernotesCollection.output'):
+                outputs.append(collection.output(directory))
+            warnings.extend(collection.warnings())
+        if images:
+            with profiler.stage('image_records'):
+                images_found = list(
+                    grab_supernote_images.image_records(file))
+
+    return outputs, images_found, warnings, index_entry
+
+
+def read_batch(path):
+    '''
+    Return the issues listed in the JSON batch manifest at path.
+
+    The manifest is a list of {"volume": ..., "number": ..., "paths":
+    [...]} objects; relative content paths are taken relative to the
+    manifest.
+    '''
+    with open(path) as f:
+        issues = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    return [(str(issue['volume']), str(issue['number']),
+             [os.path.join(base, p) for p in issue['paths']])
+            for issue in issues]
+
+
+def scan_batch_directory(root):
+    '''
+    Return the issues laid out under root as VOLUME/NUMBER/*.json.
+    '''
+    issues = []
+    for volume in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, volume)):
+            continue
+        for number in sorted(os.listdir(os.path.join(root, volume))):
+            paths = sorted(glob.glob(
+                os.path.join(root, volume, number, '*.json')))
+            if paths:
+                issues.append((volume, number, paths))
+    return issues
+
+
+def archive_path(path, volume, number, directory, streaming, options):
+    '''
+    Load the content file at path and run archive_file over it.
+
+    The article's wall time and markdown calls are recorded with the
+    profiler, as web_format.build_article does.
+    '''
+    start = time.perf_counter()
+    markdown_calls = profiler.counts.get('markdown calls', 0)
+
+    file = load(path, streaming)
+    result = archive_file(file, volume, number, directory, **options)
+
+    profiler.record_article(
+        file.content['metadata']['short-reference'],
+        seconds=time.perf_counter() - start,
+        markdown_calls=profiler.counts.get('markdown calls', 0) -
+        markdown_calls)
+    return result
+
+
+def _archive_job(job):
+    '''
+    Archive one content file in a worker.
+
+    Returns web_format.run_job's dict, with the paths written, the image
+    records, any warnings and the link index entry in place of the
+    result.
+    '''
+    job_result = web_format.run_job(archive_path, *job)
+    outputs, records, warnings, index_entry = job_result.pop('result') or \
+        ([], [], [], None)
+    job_result.update(outputs=outputs, records=records, warnings=warnings,
+                      index_entry=index_entry)
+    return job_result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate web content, supernotes and image lists '
+        'for one issue, or a batch of issues, in one pass.')
+    parser.add_argument('volume', nargs='?', help='volume number')
+    parser.add_argument('number', nargs='?', help='issue number')
+    parser.add_argument('paths', nargs='*', metavar='path',
+                        help='path(s) to JSON files for article content')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='archive the issues listed in the JSON '
+                        'manifest FILE')
+    parser.add_argument('--batch-directory', metavar='DIRECTORY',
+                        help='archive every DIRECTORY/VOLUME/NUMBER/*.json')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--no-web', dest='web', action='store_false',
+                        help='do not write web_content.html/metadata.yml')
+    parser.add_argument('--no-supernotes', dest='supernotes',
+                        action='store_false',
+                        help='do not write supernotes.json')
+    parser.add_argument('--no-images', dest='images', action='store_false',
+                        help='do not list supernote image URLs')
+    parser.add_argument('--images-output', metavar='FILE',
+                        help='write the image URL list to FILE instead '
+                        'of standard output')
+    parser.add_argument('--images-manifest', metavar='FILE',
+                        help='also write the images as JSON lines to FILE')
+    parser.add_argument('--consolidate-maps', action='store_true',
+                        help='write each article\'s maps as one JSON data '
+                        'island with a single initializer script, and '
+                        'supernote maps with compact markers')
+    parser.add_argument('--table-page-rows', type=web_format.positive_int,
+                        metavar='N',
+                        help='keep only the first N body rows of larger '
+                        'tables in the page, and write the rest to JSON '
+                        'sidecar files of N rows each')
+    parser.add_argument('--markdown-cache', metavar='DIRECTORY',
+                        help='directory for the on-disk markdown cache')
+    parser.add_argument('--stream', action='store_true',
+                        help='read content files incrementally (needs '
+                        'ijson) to keep memory flat on huge documents')
+    parser.add_argument('--link-index', metavar='FILE',
+                        help='keep an index of every article and anchor '
+                        'built in FILE and report internal links that '
+                        'do not resolve against it')
+    content_file.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    issues = []
+    if args.batch:
+        issues.extend(read_batch(args.batch))
+    if args.batch_directory:
+        issues.extend(scan_batch_directory(args.batch_directory))
+    if args.volume is not None:
+        if args.number is None or not args.paths:
+            parser.error('volume and number need content file paths')
+        issues.append((args.volume, args.number, args.paths))
+    if not issues:
+        parser.error('give a volume, number and paths, --batch or '
+                     '--batch-directory')
+
+    renderer_options = {'cache_directory': args.markdown_cache}
+    rendering.configure(**renderer_options)
+    cache_options = content_file.configure(args)
+    instrumentation.configure(args)
+
+    directory = os.getcwd()
+    options = {'web': args.web,
+               'supernotes': args.supernotes,
+               'images': args.images,
+               'consolidate_maps': args.consolidate_maps,
+               'table_page_rows': args.table_page_rows}
+    jobs = [(path, volume, number, directory, args.stream, options)
+            for volume, number, paths in issues
+            for path in content_paths(paths)]
+
+    start = time.perf_counter()
+    if args.jobs > 1:
+        import multiprocessing
+
+        with multiprocessing.Pool(
+                args.jobs, web_format.initialize_worker,
+                (renderer_options, profiler.options(),
+                 cache_options)) as pool:
+            # imap keeps results in input order, so reporting is
+            # deterministic regardless of which worker finishes first.
+            results = list(pool.imap(_archive_job, jobs))
+    else:
+        results = [_archive_job(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    image_records = []
+    failed = 0
+    written = 0
+    totals = {'hits': 0, 'misses': 0, 'disk_hits': 0}
+    run_profile = instrumentation.Profiler()
+    for result in results:
+        if result['error']:
+            failed += 1
+            sys.stderr.write('{}: failed\n{}'.format(
+                result['path'], result['error']))
+        for warning in result['warnings']:
+            sys.stderr.write('{}: {}\n'.format(result['path'], warning))
+        written += len(result['outputs'])
+        image_records.extend(result['records'])
+        for key in totals:
+            totals[key] += result['counters'][key]
+        run_profile.merge(result['profile'])
+
+    if args.link_index:
+        import link_index
+
+        link_index.report_broken_links(
+            link_index.LinkIndex(args.link_index),
+            [(result['path'], result['index_entry']) for result in results
+             if result['index_entry']],
+            sys.stderr)
+
+    if args.images:
+        image_records = list(
+            grab_supernote_images.unique_records(image_records))
+        image_names = ''.join(record['url'] + '\n'
+                              for record in image_records)
+        if args.images_output:
+            with open(args.images_output, 'w') as f:
+                f.write(image_names)
+        else:
+            print(image_names)
+        if args.images_manifest:
+            with open(args.images_manifest, 'w') as f:
+                grab_supernote_images.write_manifest(image_records, f)
+
+    if len(issues) > 1:
+        sys.stderr.write(
+            '{} issues, {} files, {} failed, {} outputs written, '
+            '{} images in {:.2f}s\n'.format(
+                len(issues), len(jobs), failed, written,
+                len(image_records), elapsed))
+        sys.stderr.write(
+            'markdown cache: {hits} hits, {misses} misses '
+            '({disk_hits} served from disk)\n'.format(**totals))
+
+    if profiler.enabled:
+        sys.stderr.write(run_profile.summary())
+
+    if failed:
+        sys.stderr.write('{} of {} files failed\n'.format(failed, len(jobs)))
+        sys.exit(1)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+'''
+Time web_format and supernotes_format on a synthetic issue.
+
+Parsing, building (Article and SupernotesCollection construction) and
+rendering are timed separately, best of --repeat runs, and the results
+are printed as JSON and optionally appended to a JSON lines file so
+that runs can be compared across commits. Nothing touches the network.
+
+    python benchmarks/bench_formats.py --paragraphs 10000 --output b.jsonl
+'''
+
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+import rendering
+import supernotes_format
+import web_format
+from content_file import ContentFile
+
+import synthetic
+
+
+def best(function, repeat):
+    '''Return (best time in seconds, last result) of calling function.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat):
+    text = json.dumps(synthetic.article(**sizes))
+
+    def parse():
+        return ContentFile(io.StringIO(text))
+
+    def build_article():
+        # Start each run cold, so markdown rendering is measured too.
+        rendering.renderer.clear()
+        return web_format.Article(file, 1, 1)
+
+    def render_article():
+        stream = io.StringIO()
+        article.write_content(stream)
+        return stream.tell()
+
+    def build_supernotes():
+        return supernotes_format.SupernotesCollection(file, 1, 1)
+
+    def render_supernotes():
+        return len(collection.generate_supernotes())
+
+    timings = {}
+    timings['parse'], file = best(parse, repeat)
+    timings['article_build'], article = best(build_article, repeat)
+    timings['article_render'], html_size = best(render_article, repeat)
+    timings['supernotes_build'], collection = best(build_supernotes, repeat)
+    timings['supernotes_render'], json_size = best(render_supernotes, repeat)
+
+    return {'commit': commit(),
+            'python': platform.python_version(),
+            'sizes': sizes,
+            'input_bytes': len(text),
+            'html_bytes': html_size,
+            'supernotes_bytes': json_size,
+            'elements': len(article.contents),
+            'seconds': timings}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark web_format and supernotes_format.')
+    parser.add_argument('--paragraphs', type=int, default=1000)
+    parser.add_argument('--gallery-images', type=int, default=20)
+    parser.add_argument('--table-rows', type=int, default=100)
+    parser.add_argument('--map-markers', type=int, default=100)
+    parser.add_argument('--supernotes-per-paragraph', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', metavar='FILE',
+                        help='append the results to FILE as a JSON line')
+    args = parser.parse_args()
+
+    sizes = {'paragraphs': args.paragraphs,
+             'gallery_images': args.gallery_images,
+             'table_rows': args.table_rows,
+             'map_markers': args.map_markers,
+             'supernotes_per_paragraph': args.supernotes_per_paragraph}
+    result = run(sizes, args.repeat)
+
+    print(json.dumps(result, indent=1))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result, sort_keys=True))
+            f.write('\n')
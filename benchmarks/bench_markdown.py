@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''
+Compare per-call markdown.markdown() with the reused converter.
+
+Renders the same set of distinct paragraph-sized snippets both ways,
+with the renderer's memo cache disabled so every snippet is converted.
+
+    python benchmarks/bench_markdown.py [count] [repeat]
+'''
+
+
+import os
+import sys
+import timeit
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+import markdown
+
+import rendering
+
+
+def snippets(count):
+    return ['Paragraph {} with *emphasis*, **strong** text and a '
+            '[link](http://example.com/{}) in the middle of it.'
+            .format(i, i) for i in range(count)]
+
+
+def per_call(texts):
+    for text in texts:
+        markdown.markdown(text)[3:-4]
+
+
+def reused(texts):
+    renderer = rendering.MarkdownRenderer(cache_size=0)
+    for text in texts:
+        renderer.render(text)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    texts = snippets(count)
+
+    before = min(timeit.repeat(lambda: per_call(texts),
+                               number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: reused(texts),
+                              number=1, repeat=repeat))
+
+    print('{} snippets, best of {}'.format(count, repeat))
+    print('markdown.markdown() per call: {:.3f}s'.format(before))
+    print('reused Markdown converter:    {:.3f}s'.format(after))
+    print('speedup: {:.2f}x'.format(before / after))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+'''
+Compare per-element memory of the slotted models with __dict__ objects.
+
+Builds a synthetic Article and SupernotesCollection, then for each
+element class copies its instances' fields both into fresh instances
+of the class and into plain objects that keep them in a per-instance
+__dict__, as the models used to. The bytes allocated for each are
+measured with tracemalloc; only the objects themselves are counted,
+not the shared strings and lists they point to.
+
+    python benchmarks/bench_memory.py [--paragraphs 2000]
+'''
+
+
+import argparse
+import io
+import json
+import os
+import sys
+import tracemalloc
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+import supernotes_format
+import web_format
+from content_file import ContentFile
+
+import synthetic
+
+
+class Plain:
+    pass
+
+
+def allocated(function):
+    '''Return the bytes still allocated after calling function.'''
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = function()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del kept
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+
+def copies(instances, factory):
+    result = []
+    for instance in instances:
+        copy = factory()
+        for name in type(instance).__slots__:
+            setattr(copy, name, getattr(instance, name))
+        result.append(copy)
+    return result
+
+
+def walk_supernotes(collection):
+    for paragraph in collection.paragraphs:
+        yield paragraph
+        for note_set in paragraph.notes:
+            yield note_set
+            for note in note_set.content:
+                if hasattr(note, '__slots__'):
+                    yield note
+
+
+def walk_article(article):
+    for element in article.contents:
+        yield element
+        if isinstance(element, web_format.ImageGallery):
+            yield from element.images
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure per-element memory of the element models.')
+    parser.add_argument('--paragraphs', type=int, default=2000)
+    args = parser.parse_args()
+
+    file = ContentFile(io.StringIO(json.dumps(
+        synthetic.article(paragraphs=args.paragraphs))))
+    article = web_format.Article(file, 1, 1)
+    collection = supernotes_format.SupernotesCollection(file, 1, 1)
+
+    instances = {}
+    for instance in list(walk_article(article)) + \
+            list(walk_supernotes(collection)):
+        key = '{}.{}'.format(type(instance).__module__,
+                             type(instance).__name__)
+        instances.setdefault(key, []).append(instance)
+
+    print('{:<36} {:>8} {:>10} {:>10}'.format(
+        'class', 'count', 'dict B/el', 'slots B/el'))
+    for key, group in sorted(instances.items()):
+        cls = type(group[0])
+        with_dict = allocated(lambda: copies(group, Plain))
+        with_slots = allocated(lambda: copies(group,
+                                              lambda: cls.__new__(cls)))
+        print('{:<36} {:>8} {:>10.0f} {:>10.0f}'.format(
+            key, len(group), with_dict / len(group),
+            with_slots / len(group)))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+'''
+Measure the import cost of each archiver entry point.
+
+Runs python -X importtime on each module in a fresh interpreter,
+best of --repeat runs, and reports the cumulative import time, the
+heaviest imports and whether markdown was loaded at startup.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--top 5]
+'''
+
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = ['archive', 'web_format', 'supernotes_format',
+           'grab_supernote_images']
+
+
+def import_times(module):
+    '''Return {imported module: cumulative microseconds} for module.'''
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure entry point import times.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5,
+                        help='number of heaviest imports to list')
+    args = parser.parse_args()
+
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        print('{:<24} {:>8.1f} ms   markdown loaded: {}'.format(
+            module, best[module] / 1000,
+            'yes' if 'markdown' in best else 'no'))
+        heaviest = sorted(
+            (item for item in best.items() if item[0] != module),
+            key=lambda item: -item[1])[:args.top]
+        for name, microseconds in heaviest:
+            print('    {:<28} {:>8.1f} ms'.format(name, microseconds / 1000))
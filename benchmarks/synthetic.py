@@ -0,0 +1,118 @@
+'''Synthetic Appendix-format content files for benchmarks.'''
+
+
+import random
+
+
+PARAGRAPH_TYPES = ['paragraph', 'editorial-intro-paragraph',
+                   'alt-voice-paragraph', 'blockquote',
+                   'stage-direction-paragraph']
+
+
+def sentence(rng, number):
+    words = ['archive', 'issue', 'journal', 'river', '*city*', 'letter',
+             '**map**', 'street', 'winter', 'harbor', 'photograph']
+    return 'Paragraph {} {}.'.format(
+        number, ' '.join(rng.choice(words) for _ in range(40)))
+
+
+def image(rng, number, credit='Photograph by A. Photographer'):
+    return {'url-format': '/000/{:03d}/***/image-{}.jpg'.format(
+                number % 1000, number),
+            'alt': 'Image {}'.format(number),
+            'caption': 'Caption for *image* {}'.format(number),
+            'credit': credit}
+
+
+def marker(rng, number):
+    return {'position': {'latitude': rng.uniform(-80, 80),
+                         'longitude': rng.uniform(-180, 180)},
+            'message': 'Marker {}'.format(number)}
+
+
+def map_element(rng, markers):
+    return {'tileset': 'toner',
+            'center': [rng.uniform(-80, 80), rng.uniform(-180, 180)],
+            'zoom': 5, 'minZoom': 2, 'maxZoom': 12,
+            'markers': [marker(rng, i) for i in range(markers)]}
+
+
+def supernotes(rng, paragraph, count):
+    kinds = ['commentary', 'citation', 'image', 'map', 'link', 'video']
+    notes = {}
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        if kind in ['commentary', 'citation']:
+            note = 'A "{}" note on paragraph {}.'.format(kind, paragraph)
+        elif kind == 'image':
+            note = image(rng, paragraph * 100 + i)
+        elif kind == 'map':
+            note = map_element(rng, 5)
+            note['center'] = {'latitude': note['center'][0],
+                              'longitude': note['center'][1]}
+        elif kind == 'link':
+            note = {'label': 'Link {}'.format(i),
+                    'url': 'http://example.com/{}'.format(i)}
+        else:
+            note = {'service': 'youtube', 'id': 'video{}'.format(i),
+                    'width': 640, 'height': 360, 'caption': 'Video'}
+        notes.setdefault(kind, []).append(note)
+    return notes
+
+
+def article(paragraphs=1000, gallery_images=20, table_rows=100,
+            map_markers=100, supernotes_per_paragraph=2, seed=0):
+    '''
+    Return a synthetic content document.
+
+    Every element type Article knows about appears at least once per
+    hundred paragraphs; the sizes of the galleries, tables and maps and
+    the number of supernotes on each paragraph are configurable.
+    '''
+    rng = random.Random(seed)
+    content = []
+    notes = {}
+    for number in range(1, paragraphs + 1):
+        content.append({
+            'type': PARAGRAPH_TYPES[number % len(PARAGRAPH_TYPES)],
+            'number': str(number),
+            'content': sentence(rng, number),
+            'internal-links': [
+                {'token': 'LINK{}'.format(number),
+                 'web': '<a href="#paragraph-{}">link</a>'.format(number)}]})
+        content[-1]['content'] += ' LINK{}'.format(number)
+        if supernotes_per_paragraph:
+            notes[str(number)] = supernotes(
+                rng, number, supernotes_per_paragraph)
+
+        if number % 100 == 1:
+            content.extend([
+                {'type': 'major-header',
+                 'content': 'Part *{}*'.format(number)},
+                {'type': 'minor-header',
+                 'content': 'Section {}'.format(number)},
+                {'type': 'image', **image(rng, number)},
+                {'type': 'anvil-gallery', 'group': 'gallery-{}'.format(number),
+                 'images': [image(rng, number * 1000 + i)
+                            for i in range(gallery_images)]},
+                {'type': 'audio',
+                 'url': 'https://s3.amazonaws.com/appendixjournal-audio'
+                        '/{}.mp3'.format(number),
+                 'label': 'Listen to *part {}*'.format(number)},
+                {'type': 'video', 'id': 'video{}'.format(number),
+                 'width': 640, 'height': 360, 'caption': 'A video'},
+                {'type': 'table', 'title': 'Table {}'.format(number),
+                 'contents': [['Cell {}-{}'.format(row, column)
+                               for column in range(6)]
+                              for row in range(table_rows)]},
+                {'type': 'map', **map_element(rng, map_markers)},
+                {'type': 'major-divider'},
+                {'type': 'minor-divider'}])
+
+    return {'metadata': {'title': 'Synthetic article',
+                         'author': ['Benchmark'],
+                         'short-reference': 'synthetic',
+                         'position': 1,
+                         'summary': 'A synthetic article.'},
+            'content': content,
+            'supernotes': notes}
@@ -0,0 +1,99 @@
+'''Build manifests recording which inputs produced an issue's outputs.'''
+
+
+import hashlib
+import json
+import os
+
+
+import output_files
+
+
+MANIFEST_NAME = '.build-manifest.json'
+
+
+def file_digest(path):
+    '''Return the SHA-256 hex digest of the file at path.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def generator_version(*paths):
+    '''
+    Return a version string for a generator made of the given sources.
+
+    Any edit to the generator's code invalidates everything it built.
+    '''
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_digest(path).encode('ascii'))
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    '''
+    Per-issue record of the input files each generator has built.
+
+    The manifest lives in the issue-{volume}-{number} directory and has
+    one section per generator, holding the generator version and, for
+    each input file, its digest and the outputs it produced. Inputs are
+    current when their digest, the generator version and all recorded
+    outputs are unchanged.
+    '''
+    path = None
+    generator = None
+    version = None
+    files = None
+
+    def __init__(self, issue_directory, generator, version):
+        self.path = os.path.join(issue_directory, MANIFEST_NAME)
+        self.generator = generator
+        self.version = version
+        self.files = {}
+
+        section = self._read().get(generator, {})
+        if section.get('version') == version:
+            self.files = section.get('files', {})
+
+    def is_current(self, path, digest):
+        entry = self.files.get(self._key(path))
+        if not entry or entry['digest'] != digest:
+            return False
+        directory = os.path.dirname(self.path)
+        return all(os.path.exists(os.path.join(directory, output))
+                   for output in entry['outputs'])
+
+    def record(self, path, digest, outputs):
+        '''Record that path, with digest, produced the output paths.'''
+        directory = os.path.dirname(self.path)
+        self.files[self._key(path)] = {
+            'digest': digest,
+            'outputs': [os.path.relpath(output, directory)
+                        for output in outputs]}
+
+    def save(self):
+        '''
+        Write this generator's section back to the manifest.
+
+        Sections written by other generators in the meantime are kept.
+        '''
+        data = self._read()
+        data[self.generator] = {'version': self.version, 'files': self.files}
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with output_files.atomic_open(self.path) as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _key(self, path):
+        return os.path.realpath(path)
@@ -0,0 +1,196 @@
+'''Loading of production content files in Appendix JSON format.'''
+
+
+import collections.abc
+import json
+
+
+from instrumentation import profiler
+
+
+# ijson is optional and only imported when a file is streamed.
+ijson = None
+
+# The document_cache.DocumentCache parsed files are loaded through, if
+# one is configured.
+cache = None
+
+
+# Files which sit alongside the article JSON in an issue bundle but are
+# not article content.
+SKIPPED_NAMES = [
+    'contributors', 'cover.jpg', 'bundle.json',
+    'cover-chapter-1.jpg', 'cover-chapter-2.jpg',
+    'cover-chapter-3.jpg']
+
+
+class ContentFile:
+    '''Representation of production content file in Appendix JSON format.'''
+    stream = None
+    content = None
+    streaming = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        with profiler.stage('read'):
+            text = self.stream.read()
+        with profiler.stage('json.loads'):
+            self.content = json.loads(text)
+
+
+class CachedContentFile:
+    '''Content file whose parsed document came from the cache.'''
+    content = None
+    streaming = False
+
+    def __init__(self, content):
+        self.content = content
+
+
+class StreamingContentFile:
+    '''
+    Content file read incrementally with ijson.
+
+    content behaves like the parsed document, but 'content' yields the
+    elements one at a time and each access to it re-reads the file, so
+    the document is never held in memory as a whole. 'metadata' is read
+    up front.
+    '''
+    path = None
+    content = None
+    streaming = True
+
+    def __init__(self, path):
+        _import_ijson()
+        self.path = path
+        self.content = _StreamingContent(path)
+
+
+class _StreamingContent(collections.abc.Mapping):
+    path = None
+    names = None
+    metadata = None
+    supernotes = None
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.metadata = {}
+
+        # One pass over the parser events collects the top-level keys
+        # and builds the metadata object, without building anything
+        # else.
+        builder = ijson.ObjectBuilder()
+        with open(path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if prefix == '' and event == 'map_key':
+                    self.names.append(value)
+                elif prefix == 'metadata' or prefix.startswith('metadata.'):
+                    builder.event(event, value)
+        if hasattr(builder, 'value'):
+            self.metadata = builder.value
+
+    def __getitem__(self, key):
+        if key not in self.names:
+            raise KeyError(key)
+        if key == 'metadata':
+            return self.metadata
+        if key == 'content':
+            return self._items('content.item')
+        if key == 'supernotes':
+            # Supernotes are emitted in numerical paragraph order, so
+            # they are collected into a dict rather than streamed, once.
+            if self.supernotes is None:
+                with open(self.path, 'rb') as f:
+                    self.supernotes = dict(
+                        ijson.kvitems(f, 'supernotes', use_float=True))
+            return self.supernotes
+        with open(self.path, 'rb') as f:
+            return next(ijson.items(f, key, use_float=True))
+
+    def __contains__(self, key):
+        # Mapping's default would parse the value just to test the key.
+        return key in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _items(self, prefix):
+        with open(self.path, 'rb') as f:
+            yield from ijson.items(f, prefix, use_float=True)
+
+
+def _import_ijson():
+    global ijson
+    try:
+        import ijson
+    except ImportError:
+        raise RuntimeError(
+            'streaming content files require the ijson package') from None
+
+
+def content_paths(paths):
+    '''Return the paths which name article content files.'''
+    return [path for path in paths
+            if path.split('/')[-1] not in SKIPPED_NAMES]
+
+
+def configure_cache(directory=None, **kwargs):
+    '''
+    Load parsed files through a document cache in directory.
+
+    kwargs are passed on to document_cache.DocumentCache; with no
+    directory, the cache is turned off.
+    '''
+    global cache
+    cache = None
+    if directory:
+        import document_cache
+
+        cache = document_cache.DocumentCache(directory, **kwargs)
+    return cache
+
+
+def add_arguments(parser):
+    '''Add the --document-cache options to an argparse parser.'''
+    parser.add_argument('--document-cache', metavar='DIRECTORY',
+                        help='directory for the on-disk cache of parsed '
+                        'content files')
+    parser.add_argument('--clear-document-cache', action='store_true',
+                        help='empty the document cache before the run')
+
+
+def configure(args):
+    '''
+    Set up the document cache from parsed --document-cache options.
+
+    Returns the keyword arguments for configure_cache, for workers.
+    '''
+    options = {'directory': args.document_cache}
+    configure_cache(**options)
+    if args.clear_document_cache and cache is not None:
+        cache.clear()
+    return options
+
+
+def load(path, streaming=False):
+    '''
+    Parse the content file at path, closing it afterwards.
+
+    With streaming, return a StreamingContentFile instead. Otherwise the
+    document cache is used, if one is configured.
+    '''
+    if streaming:
+        return StreamingContentFile(path)
+    if cache is not None:
+        return CachedContentFile(cache.load(path, _parse))
+    with open(path) as stream:
+        return ContentFile(stream)
+
+
+def _parse(data):
+    with profiler.stage('json.loads'):
+        return json.loads(data)
@@ -1,69 +1,112 @@
 #!/usr/bin/env python3
 
 
+import argparse
 import json
-import os
 import sys
 
 
-class ContentFile:
-    stream = None
-    content = None
+from content_file import content_paths, load
 
-    def __init__(self, stream):
-        self.stream = stream
-        self.content = json.loads(self.stream.read())
 
+IMAGE_URL = 'http://s3.amazonaws.com/appendixjournal-images' + \
+    '/images/attachments{}'
 
-def generate_img_names(file):
-    result = ''
 
-    wrapper = 'http://s3.amazonaws.com/appendixjournal-images' + \
-        '/images/attachments{}\n'
+def image_records(file):
+    '''
+    Yield a record for every supernote image variant in file.
+
+    Records are dicts with the url, the variant, the short reference of
+    the source article and the paragraph number. Every occurrence is
+    yielded; see unique_records.
+    '''
+    article = file.content['metadata'].get('short-reference')
 
-    for key in file.content['supernotes'].keys():
-        paragraph = file.content['supernotes'][key]
+    supernotes = file.content['supernotes']
+    for key in supernotes.keys():
+        paragraph = supernotes[key]
 
         if 'image' in paragraph:
-            thumbnail_flag = len(paragraph['image']) > 1
+            variants = ['medium', 'large']
+            if len(paragraph['image']) > 1:
+                variants.append('thumbnail')
             for image in paragraph['image']:
-                result += wrapper.format(
-                    image['url-format'].replace('***', 'medium'))
-                result += wrapper.format(
-                    image['url-format'].replace('***', 'large'))
-                if thumbnail_flag:
-                    result += wrapper.format(
-                        image['url-format'].replace('***', 'thumbnail'))
+                for variant in variants:
+                    yield {'url': IMAGE_URL.format(
+                               image['url-format'].replace('***', variant)),
+                           'variant': variant,
+                           'article': article,
+                           'paragraph': int(key)}
+
+
+def unique_records(records):
+    '''Yield the first record for each URL, keeping their order.'''
+    seen = set()
+    for record in records:
+        if record['url'] not in seen:
+            seen.add(record['url'])
+            yield record
+
 
-    return result
+def write_manifest(records, stream):
+    '''Write records to stream as JSON lines.'''
+    for record in records:
+        stream.write(json.dumps(record, sort_keys=True))
+        stream.write('\n')
+
+
+def generate_img_names(file):
+    '''Return the distinct image URLs for file, one per line.'''
+    return ''.join(record['url'] + '\n'
+                   for record in unique_records(image_records(file)))
 
 
 if __name__ == '__main__':
-    content_files = []
-    skipped_names = [
-        'contributors', 'cover.jpg', 'bundle.json',
-        'cover-chapter-1.jpg', 'cover-chapter-2.jpg',
-        'cover-chapter-3.jpg']
-    volume = None
-    number = None
-
-    for idx, arg in enumerate(sys.argv):
-        if idx == 0:
-            pass
-        elif idx == 1:
-            volume = arg
-        elif idx == 2:
-            number = arg
-        else:
-            name = arg.split('/')[-1]
-            if name not in skipped_names:
-                content_files.append(ContentFile(open(arg)))
-
-    current_directory = os.getcwd()
-    result = ''
-    for file in content_files:
-        os.chdir(current_directory)
+    parser = argparse.ArgumentParser(
+        description='List, or fetch, the supernote images for an issue.')
+    parser.add_argument('volume', help='volume number')
+    parser.add_argument('number', help='issue number')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='path(s) to JSON files for article content')
+    parser.add_argument('--fetch', metavar='DIRECTORY',
+                        help='download the images into DIRECTORY instead '
+                        'of listing their URLs')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent downloads (default: 8)')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='retries per image on transient errors '
+                        '(default: 3)')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='also write the images as JSON lines (url, '
+                        'variant, article, paragraph) to FILE')
+    args = parser.parse_args()
+
+    records = []
+    for path in content_paths(args.paths):
+        file = load(path)
         if 'supernotes' in file.content:
-            result += generate_img_names(file)
-
-    print(result)
+            records.extend(image_records(file))
+    # Images shared between paragraphs or articles are only listed once.
+    records = list(unique_records(records))
+    urls = [record['url'] for record in records]
+
+    if args.manifest:
+        with open(args.manifest, 'w') as f:
+            write_manifest(records, f)
+
+    if args.fetch:
+        # Only needed when fetching; listing stays free of these imports.
+        import image_fetch
+
+        fetcher = image_fetch.ImageFetcher(
+            args.fetch, concurrency=args.concurrency, retries=args.retries)
+        failed = 0
+        for url, status in fetcher.fetch(urls):
+            if status not in ['downloaded', 'unchanged', 'skipped']:
+                failed += 1
+                sys.stderr.write('{}: {}\n'.format(url, status))
+        if failed:
+            sys.exit(1)
+    else:
+        print(''.join(url + '\n' for url in urls))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+'''
+Generate the large, medium and thumb images for an issue locally.
+
+web_format.py links every article image as
+/images/issues/{volume}/{number}/{variant}-{url_template}. Given a
+directory holding the original of each image, named by its
+url_template, this writes all of those variants with a process pool
+instead of downloading each of them.
+'''
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+import build_manifest
+import output_files
+from content_file import content_paths, load
+
+
+# Longest side, in pixels, of each variant.
+DERIVATIVE_SIZES = {'large': 1600, 'medium': 800, 'thumb': 200}
+
+CACHE_NAME = '.derivatives.json'
+
+
+def image_templates(file):
+    '''Yield the url_template of every article image in file.'''
+    for element in file.content['content']:
+        if element['type'] == 'image':
+            images = [element]
+        elif element['type'] == 'anvil-gallery':
+            images = element['images']
+        else:
+            continue
+        for image in images:
+            yield re.split('/', image['url-format'])[-1]
+
+
+def make_derivative(job):
+    '''
+    Resize the original at source to fit size and save it at target.
+
+    Returns (target, error or None).
+    '''
+    source, target, size = job
+    try:
+        with Image.open(source) as original:
+            image_format = original.format
+            derivative = original.copy()
+        derivative.thumbnail((size, size))
+
+        with output_files.atomic_open(target, 'wb') as f:
+            derivative.save(f, format=image_format)
+    except Exception as e:
+        return target, '{}: {}'.format(type(e).__name__, e)
+    return target, None
+
+
+class DerivativeCache:
+    '''
+    Record of the source digest and size each derivative was made from.
+
+    Stored as CACHE_NAME in the output directory; a derivative is
+    current when it exists and both match.
+    '''
+    path = None
+    entries = None
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, CACHE_NAME)
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def is_current(self, target, digest, size):
+        entry = self.entries.get(os.path.basename(target))
+        return entry == {'source': digest, 'size': size} and \
+            os.path.exists(target)
+
+    def record(self, target, digest, size):
+        self.entries[os.path.basename(target)] = \
+            {'source': digest, 'size': size}
+
+    def save(self):
+        with output_files.atomic_open(self.path) as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+def derivative_jobs(templates, originals, output, sizes, cache):
+    '''
+    Return (jobs to run, source digests, missing originals).
+
+    Jobs are (source, target, size) for each derivative not already
+    current in cache.
+    '''
+    jobs = []
+    digests = {}
+    missing = []
+    for template in templates:
+        source = os.path.join(originals, template)
+        if not os.path.exists(source):
+            missing.append(source)
+            continue
+        digests[source] = build_manifest.file_digest(source)
+        for variant, size in sorted(sizes.items()):
+            target = os.path.join(output, '{}-{}'.format(variant, template))
+            if not cache.is_current(target, digests[source], size):
+                jobs.append((source, target, size))
+    return jobs, digests, missing
+
+
+def parse_size(value):
+    variant, _, size = value.partition('=')
+    return variant, int(size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate image derivatives for an issue locally.')
+    parser.add_argument('volume', help='volume number')
+    parser.add_argument('number', help='issue number')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='path(s) to JSON files for article content')
+    parser.add_argument('--originals', required=True, metavar='DIRECTORY',
+                        help='directory holding the original images, '
+                        'named by their url_template')
+    parser.add_argument('--output', metavar='DIRECTORY',
+                        help='where to write the derivatives (default: '
+                        'images/issues/VOLUME/NUMBER)')
+    parser.add_argument('--size', action='append', type=parse_size,
+                        default=[], metavar='VARIANT=PIXELS',
+                        help='override the longest side of a variant')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes '
+                        '(default: one per CPU)')
+    args = parser.parse_args()
+
+    if Image is None:
+        sys.exit('image_derivatives.py requires Pillow')
+
+    sizes = dict(DERIVATIVE_SIZES)
+    sizes.update(args.size)
+    output = args.output or os.path.join(
+        'images', 'issues', args.volume, args.number)
+    os.makedirs(output, exist_ok=True)
+
+    templates = {}
+    for path in content_paths(args.paths):
+        for template in image_templates(load(path)):
+            templates[template] = True
+
+    cache = DerivativeCache(output)
+    jobs, digests, missing = derivative_jobs(
+        templates, args.originals, output, sizes, cache)
+    for source in missing:
+        sys.stderr.write('{}: original not found\n'.format(source))
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        results = pool.map(make_derivative, jobs)
+
+    failed = 0
+    for (source, target, size), (_, error) in zip(jobs, results):
+        if error:
+            failed += 1
+            sys.stderr.write('{}: {}\n'.format(target, error))
+        else:
+            cache.record(target, digests[source], size)
+    cache.save()
+
+    sys.stderr.write('{} derivatives written, {} up to date\n'.format(
+        len(jobs) - failed,
+        len(digests) * len(sizes) - len(jobs)))
+    if failed or missing:
+        sys.exit(1)
@@ -0,0 +1,150 @@
+'''Concurrent downloading of image URLs with resume and retries.'''
+
+
+import concurrent.futures
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+
+import output_files
+
+
+ETAGS_NAME = '.etags.json'
+
+
+class ImageFetcher:
+    '''
+    Download URLs into a directory with a bounded pool of threads.
+
+    Each thread keeps one persistent connection per host. A URL is saved
+    under directory at its URL path. Files already on disk are skipped,
+    unless their ETag was recorded, in which case they are revalidated
+    with a conditional request. Connection errors and 429/5xx responses
+    are retried with exponential backoff.
+    '''
+    directory = None
+    concurrency = None
+    retries = None
+    backoff = None
+    timeout = None
+    etags = None
+
+    def __init__(self, directory, concurrency=8, retries=3, backoff=0.5,
+                 timeout=30):
+        self.directory = directory
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.etags = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        try:
+            with open(os.path.join(directory, ETAGS_NAME)) as f:
+                self.etags = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def fetch(self, urls):
+        '''
+        Download every URL and return a list of (url, status) pairs.
+
+        status is 'downloaded', 'unchanged', 'skipped', or an error
+        message; the list is in the order of urls.
+        '''
+        with concurrent.futures.ThreadPoolExecutor(
+                self.concurrency) as executor:
+            results = list(executor.map(self._fetch_one, urls))
+        self._save_etags()
+        return results
+
+    def path_for(self, url):
+        path = urllib.parse.urlsplit(url).path.lstrip('/')
+        return os.path.join(self.directory, *path.split('/'))
+
+    def _fetch_one(self, url):
+        path = self.path_for(url)
+        key = os.path.relpath(path, self.directory)
+        headers = {}
+        if os.path.exists(path):
+            with self._lock:
+                etag = self.etags.get(key)
+            if etag is None:
+                return url, 'skipped'
+            headers['If-None-Match'] = etag
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                status, etag = self._get(url, path, headers)
+            except (OSError, http.client.HTTPException) as e:
+                self._drop_connection(url)
+                error = '{}: {}'.format(type(e).__name__, e)
+                continue
+
+            if status == 304:
+                return url, 'unchanged'
+            if status == 200:
+                if etag:
+                    with self._lock:
+                        self.etags[key] = etag
+                return url, 'downloaded'
+            error = 'HTTP {}'.format(status)
+            if status != 429 and status < 500:
+                break
+
+        return url, error
+
+    def _get(self, url, path, headers):
+        parts = urllib.parse.urlsplit(url)
+        request_path = parts.path
+        if parts.query:
+            request_path += '?' + parts.query
+
+        connection = self._connection(parts)
+        connection.request('GET', request_path, headers=headers)
+        response = connection.getresponse()
+        if response.status != 200:
+            # Read the body so the connection can be reused.
+            response.read()
+            return response.status, None
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with output_files.atomic_open(path, 'wb') as f:
+            for block in iter(lambda: response.read(1 << 16), b''):
+                f.write(block)
+        return response.status, response.getheader('ETag')
+
+    def _connection(self, parts):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (parts.scheme, parts.netloc)
+        if key not in connections:
+            if parts.scheme == 'https':
+                connection_class = http.client.HTTPSConnection
+            else:
+                connection_class = http.client.HTTPConnection
+            connections[key] = connection_class(
+                parts.netloc, timeout=self.timeout)
+        return connections[key]
+
+    def _drop_connection(self, url):
+        parts = urllib.parse.urlsplit(url)
+        connections = getattr(self._local, 'connections', {})
+        connection = connections.pop((parts.scheme, parts.netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def _save_etags(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with output_files.atomic_open(
+                os.path.join(self.directory, ETAGS_NAME)) as f:
+            json.dump(self.etags, f, indent=1, sort_keys=True)
@@ -0,0 +1,155 @@
+'''
+Opt-in timing and counting of the stages of an archiver run.
+
+Profiling is off unless enabled with --profile, or by setting the
+ARCHIVER_PROFILE environment variable; ARCHIVER_PROFILE_OUTPUT (or
+--profile-output) additionally names a file for cProfile statistics.
+'''
+
+
+import contextlib
+import os
+import time
+
+
+class Profiler:
+    '''
+    Accumulates the time spent in, and entries to, named stages.
+
+    Stages nest, so their times are inclusive: 'Paragraph.__init__'
+    includes the 'markdown' time of the paragraphs it renders. Counters
+    and per-article figures are kept alongside. Everything is a no-op
+    while the profiler is disabled.
+    '''
+    enabled = False
+    profile_path = None
+    stages = None
+    counts = None
+    articles = None
+
+    def __init__(self, enabled=False, profile_path=None):
+        self.stages = {}
+        self.counts = {}
+        self.articles = {}
+        self._profile = None
+        self.configure(enabled, profile_path)
+
+    def configure(self, enabled=False, profile_path=None):
+        self.enabled = bool(enabled or profile_path)
+        self.profile_path = profile_path
+
+    def options(self):
+        return {'enabled': self.enabled, 'profile_path': self.profile_path}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, calls=1):
+        entry = self.stages.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def record_article(self, name, **figures):
+        if self.enabled:
+            self.articles[name] = figures
+
+    @contextlib.contextmanager
+    def profiled(self):
+        '''
+        Run the body under cProfile when a profile path is set.
+
+        Statistics accumulate per process and are dumped after each
+        body, to profile_path in the main process and to
+        profile_path.PID in workers.
+        '''
+        if not self.profile_path:
+            yield
+            return
+        import cProfile
+        import multiprocessing
+
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+        self._profile.enable()
+        try:
+            yield
+        finally:
+            self._profile.disable()
+            path = self.profile_path
+            if multiprocessing.parent_process() is not None:
+                path = '{}.{}'.format(path, os.getpid())
+            self._profile.dump_stats(path)
+
+    def snapshot(self):
+        '''Return the figures collected so far, e.g. to merge elsewhere.'''
+        return {'stages': {name: list(entry)
+                           for name, entry in self.stages.items()},
+                'counts': dict(self.counts),
+                'articles': dict(self.articles)}
+
+    def reset(self):
+        self.stages = {}
+        self.counts = {}
+        self.articles = {}
+
+    def merge(self, snapshot):
+        for name, (calls, seconds) in snapshot['stages'].items():
+            self.add(name, seconds, calls)
+        for name, n in snapshot['counts'].items():
+            self.counts[name] = self.counts.get(name, 0) + n
+        self.articles.update(snapshot['articles'])
+
+    def summary(self):
+        lines = ['{:<40} {:>10} {:>12}'.format('stage', 'calls', 'seconds')]
+        for name, (calls, seconds) in sorted(
+                self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<40} {:>10} {:>12.4f}'.format(
+                name, calls, seconds))
+        if self.counts:
+            lines.append('')
+            for name, n in sorted(self.counts.items()):
+                lines.append('{:<40} {:>10}'.format(name, n))
+        for name, figures in sorted(self.articles.items()):
+            lines.append('')
+            lines.append('article {}'.format(name))
+            for figure, value in sorted(figures.items()):
+                if isinstance(value, float):
+                    value = '{:.4f}'.format(value)
+                lines.append('  {:<38} {:>10}'.format(figure, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _from_environment():
+    return Profiler(
+        enabled=os.environ.get('ARCHIVER_PROFILE', '') not in ['', '0'],
+        profile_path=os.environ.get('ARCHIVER_PROFILE_OUTPUT') or None)
+
+
+profiler = _from_environment()
+
+
+def add_arguments(parser):
+    '''Add the --profile options to an argparse parser.'''
+    parser.add_argument('--profile', action='store_true',
+                        help='report per-stage timings and counts on '
+                        'standard error')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='also write cProfile statistics to FILE')
+
+
+def configure(args):
+    '''Enable the profiler from parsed --profile options.'''
+    if args.profile or args.profile_output:
+        profiler.configure(True, args.profile_output)
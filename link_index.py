@@ -0,0 +1,125 @@
+'''Catalogue-wide index of the articles and anchors links point at.'''
+
+
+import json
+import os
+import re
+import urllib.parse
+
+
+import output_files
+
+
+HREF = re.compile(r'href="([^"]*)"')
+
+
+class LinkIndex:
+    '''
+    Persistent index of every article built, across all issues.
+
+    For each short reference the index holds the article's volume and
+    number, the ids of the anchors on its page and the internal links
+    it makes. Articles are added as they are built, so links can be
+    checked against the whole catalogue rather than only the articles
+    of one run, with a dictionary and set lookup per link.
+    '''
+    path = None
+    articles = None
+    updated = None
+
+    def __init__(self, path):
+        self.path = path
+        self.articles = {}
+        self.updated = set()
+        for reference, entry in self._read().items():
+            self.articles[reference] = {
+                'volume': entry['volume'],
+                'number': entry['number'],
+                'anchors': set(entry['anchors']),
+                'links': [tuple(link) for link in entry['links']]}
+
+    def record(self, entry):
+        '''
+        Add or replace an article from its Article.index_entry().
+
+        The hrefs are taken from the markup of each internal link.
+        '''
+        reference = entry['short_reference']
+        self.articles[reference] = {
+            'volume': entry['volume'],
+            'number': entry['number'],
+            'anchors': set(entry['anchors']),
+            'links': [(paragraph, href)
+                      for paragraph, web in entry['links']
+                      for href in HREF.findall(web)]}
+        self.updated.add(reference)
+
+    def resolve(self, href, reference=None):
+        '''
+        Return whether href points at an indexed article and anchor.
+
+        The last segment of the path is the short reference of the
+        article; a link with no path is to the article with the given
+        reference. Links to other sites are not checked.
+        '''
+        parts = urllib.parse.urlsplit(href)
+        if parts.scheme or parts.netloc:
+            return True
+        segments = [segment for segment in parts.path.split('/') if segment]
+        if segments:
+            reference = segments[-1]
+        entry = self.articles.get(reference)
+        if entry is None:
+            return False
+        return not parts.fragment or parts.fragment in entry['anchors']
+
+    def broken_links(self, reference):
+        '''Return (paragraph, href) for each link of reference that fails.'''
+        entry = self.articles.get(reference)
+        if entry is None:
+            return []
+        return [(paragraph, href) for paragraph, href in entry['links']
+                if not self.resolve(href, reference)]
+
+    def save(self):
+        '''
+        Write the articles recorded since loading back to the index.
+
+        Articles recorded by other runs in the meantime are kept.
+        '''
+        data = self._read()
+        for reference in self.updated:
+            entry = self.articles[reference]
+            data[reference] = {'volume': entry['volume'],
+                               'number': entry['number'],
+                               'anchors': sorted(entry['anchors']),
+                               'links': entry['links']}
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with output_files.atomic_open(self.path) as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+def report_broken_links(index, built, stream):
+    '''
+    Record a run's articles in index, report their broken links and save.
+
+    built is a list of (content path, Article.index_entry()) pairs. Links
+    are checked once every article of the run is in the index, so links
+    between them resolve whatever order they were built in.
+    '''
+    for _, entry in built:
+        index.record(entry)
+    for path, entry in built:
+        for paragraph, href in index.broken_links(entry['short_reference']):
+            stream.write('{}: paragraph {}: link to {} does not resolve\n'
+                         .format(path, paragraph, href))
+    index.save()
@@ -0,0 +1,156 @@
+'''
+Bounds and per-zoom marker clusters for maps with many markers.
+
+Markers are projected to Web Mercator, as Leaflet draws them, and
+grouped at each zoom level into the cells of a grid CLUSTER_PIXELS
+wide on screen. The projection and grouping are vectorized with numpy
+when it is installed, and done marker by marker otherwise.
+
+The clusters are sent alongside the full list of markers, not instead
+of it, since each marker's popup message is needed once it is drawn on
+its own. To bound what they add to a page, a cluster is only its
+position and count; its bounds are those of its grid cell, which the
+page works out from its position. Zoom levels where clustering would
+leave more than CLUSTER_BUDGET of the markers to draw are not sent, and
+every marker is drawn at them.
+'''
+
+
+import math
+
+
+# Maps with fewer markers than this are not clustered.
+CLUSTER_MINIMUM = 200
+
+# Zoom levels are clustered while at most this fraction of the markers
+# is left to draw.
+CLUSTER_BUDGET = 0.9
+
+# The width on screen, in pixels, of the cells markers are grouped in.
+CLUSTER_PIXELS = 80
+
+# Leaflet's tiles are 256 pixels wide, and Web Mercator stops short of
+# the poles.
+TILE_PIXELS = 256
+MAXIMUM_LATITUDE = 85.0511287798
+
+# Cluster positions are rounded to this many decimal places, about a
+# metre.
+PRECISION = 5
+
+numpy = None
+
+
+def marker_data(points, min_zoom, max_zoom):
+    '''
+    Return the bounds and clusters to add to a map's compact data.
+
+    points is a list of (latitude, longitude) pairs, one per marker.
+    'bounds' is [[south, west], [north, east]]. For maps with at least
+    CLUSTER_MINIMUM markers, 'clusters' maps zoom levels from min_zoom
+    to what is drawn at them: the index of a marker standing alone, or
+    [latitude, longitude, count] for a cluster of markers. Levels stop
+    at the first with more than CLUSTER_BUDGET entries per marker, and
+    at max_zoom; above them every marker is drawn.
+    '''
+    if not points:
+        return {}
+    latitudes = [point[0] for point in points]
+    longitudes = [point[1] for point in points]
+    data = {'bounds': [[min(latitudes), min(longitudes)],
+                       [max(latitudes), max(longitudes)]]}
+    if len(points) >= CLUSTER_MINIMUM:
+        data['clusters'] = {}
+        for zoom, clusters in cluster_markers(
+                latitudes, longitudes, min_zoom, max_zoom):
+            # Each level's cells split those of the level before, so no
+            # later level has fewer entries.
+            if len(clusters) > len(points) * CLUSTER_BUDGET:
+                break
+            data['clusters'][str(zoom)] = clusters
+    return data
+
+
+def cluster_markers(latitudes, longitudes, min_zoom, max_zoom):
+    '''Yield (zoom, clusters) for each zoom level below max_zoom.'''
+    if _import_numpy():
+        return _cluster_vectorized(latitudes, longitudes, min_zoom, max_zoom)
+    return _cluster(latitudes, longitudes, min_zoom, max_zoom)
+
+
+def _cluster(latitudes, longitudes, min_zoom, max_zoom):
+    xs = [(longitude + 180) / 360 for longitude in longitudes]
+    ys = []
+    for latitude in latitudes:
+        latitude = max(-MAXIMUM_LATITUDE, min(MAXIMUM_LATITUDE, latitude))
+        ys.append(0.5 - math.log(math.tan(
+            math.pi / 4 + math.radians(latitude) / 2)) / (2 * math.pi))
+
+    for zoom in range(int(min_zoom), int(max_zoom)):
+        cells = TILE_PIXELS * 2 ** zoom / CLUSTER_PIXELS
+        groups = {}
+        for index, (x, y) in enumerate(zip(xs, ys)):
+            groups.setdefault((math.floor(x * cells), math.floor(y * cells)),
+                              []).append(index)
+
+        clusters = []
+        for _, members in sorted(groups.items()):
+            if len(members) == 1:
+                clusters.append(members[0])
+                continue
+            clusters.append(_cluster_entry(
+                sum(latitudes[i] for i in members) / len(members),
+                sum(longitudes[i] for i in members) / len(members),
+                len(members)))
+        yield zoom, clusters
+
+
+def _cluster_vectorized(latitudes, longitudes, min_zoom, max_zoom):
+    latitudes = numpy.asarray(latitudes, dtype=float)
+    longitudes = numpy.asarray(longitudes, dtype=float)
+    xs = (longitudes + 180) / 360
+    clipped = numpy.radians(
+        numpy.clip(latitudes, -MAXIMUM_LATITUDE, MAXIMUM_LATITUDE))
+    ys = 0.5 - numpy.log(numpy.tan(numpy.pi / 4 + clipped / 2)) / \
+        (2 * numpy.pi)
+
+    for zoom in range(int(min_zoom), int(max_zoom)):
+        cells = TILE_PIXELS * 2 ** zoom / CLUSTER_PIXELS
+        column = numpy.floor(xs * cells).astype(numpy.int64)
+        row = numpy.floor(ys * cells).astype(numpy.int64)
+        # Sorted by column, then row, as the loop above sorts its cells.
+        keys = numpy.stack([column, row], axis=1)
+        _, first, group, counts = numpy.unique(
+            keys, axis=0, return_index=True, return_inverse=True,
+            return_counts=True)
+        group = group.reshape(-1)
+        n = len(counts)
+
+        sum_latitudes = numpy.bincount(group, latitudes, n)
+        sum_longitudes = numpy.bincount(group, longitudes, n)
+
+        clusters = []
+        for index, count, latitude, longitude in zip(
+                first.tolist(), counts.tolist(),
+                sum_latitudes.tolist(), sum_longitudes.tolist()):
+            if count == 1:
+                clusters.append(index)
+                continue
+            clusters.append(_cluster_entry(
+                latitude / count, longitude / count, count))
+        yield zoom, clusters
+
+
+def _cluster_entry(latitude, longitude, count):
+    return [round(latitude, PRECISION), round(longitude, PRECISION), count]
+
+
+def _import_numpy():
+    '''Import numpy if it is installed, returning whether it is.'''
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy is not False
@@ -0,0 +1,52 @@
+'''Atomic, buffered writing of the archiver's output files.'''
+
+
+import contextlib
+import itertools
+import os
+
+
+# Output files are written through a large buffer, since elements
+# stream many small chunks into them.
+WRITE_BUFFER_SIZE = 1 << 16
+
+_temporary_names = itertools.count()
+
+
+def article_directory(directory, volume, number, short_reference):
+    '''
+    Create and return the absolute path of an article's output directory.
+
+    That is issue-{volume}-{number}/{short_reference} below directory.
+    '''
+    path = os.path.join(os.path.abspath(directory),
+                        'issue-{}-{}'.format(volume, number),
+                        short_reference)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', buffering=WRITE_BUFFER_SIZE, **kwargs):
+    '''
+    Open path for writing, replacing it only once the body succeeds.
+
+    The file is written to a temporary file in the same directory, which
+    is renamed over path when the body completes, so path is never seen
+    half written; if the body raises, the temporary file is removed and
+    path is left as it was. Temporary names are unique per process and
+    call, so several processes and threads can write at once.
+    '''
+    directory, name = os.path.split(os.path.abspath(path))
+    temporary = os.path.join(directory, '.{}.{}-{}.tmp'.format(
+        name, os.getpid(), next(_temporary_names)))
+    # Created like open() would, so the permissions follow the umask.
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with open(fd, mode, buffering=buffering, **kwargs) as f:
+            yield f
+        os.replace(temporary, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temporary)
+        raise
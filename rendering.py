@@ -0,0 +1,154 @@
+'''Shared markdown rendering for the archiver output generators.'''
+
+
+import collections
+import json
+import os
+
+
+import output_files
+from instrumentation import profiler
+
+
+# markdown, with its extensions, is only imported once something is
+# actually rendered, keeping it out of the startup of every script.
+markdown = None
+
+# Bump when the shape of rendered fragments changes, so that entries in
+# on-disk caches written by older versions are not reused.
+CACHE_FORMAT = 2
+
+
+class MarkdownRenderer:
+    '''
+    Render markdown snippets to inline HTML fragments.
+
+    A single markdown.Markdown converter is built per renderer (and so
+    per process) and reset between snippets, rather than paying for a
+    new converter and its processors on every markdown.markdown() call.
+
+    Results are memoized in a bounded LRU cache in memory and, when
+    cache_directory is set, in a content-addressed cache on disk keyed
+    by the source text and the markdown extension configuration.
+    '''
+    extensions = None
+    extension_configs = None
+    cache_size = None
+    cache_directory = None
+    hits = 0
+    misses = 0
+    disk_hits = 0
+
+    def __init__(self, extensions=None, extension_configs=None,
+                 cache_size=4096, cache_directory=None):
+        self.extensions = list(extensions or [])
+        self.extension_configs = dict(extension_configs or {})
+        self.cache_size = cache_size
+        self.cache_directory = cache_directory
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._cache = collections.OrderedDict()
+        self._converter = None
+        self._config_key = None
+
+    def render(self, text):
+        '''Return the inline HTML for text, using the caches if possible.'''
+        profiler.count('markdown calls')
+        try:
+            result = self._cache[text]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(text)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = None
+        if self.cache_directory:
+            result = self._load(text)
+        if result is None:
+            result = self._convert(text)
+            if self.cache_directory:
+                self._store(text, result)
+        else:
+            self.disk_hits += 1
+
+        self._cache[text] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return result
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'size': len(self._cache)}
+
+    def clear(self):
+        self._cache.clear()
+
+    def _convert(self, text):
+        with profiler.stage('markdown'):
+            if self._converter is None:
+                _import_markdown()
+                self._converter = markdown.Markdown(
+                    extensions=self.extensions,
+                    extension_configs=self.extension_configs)
+            return inline_fragment(self._converter.reset().convert(text))
+
+    def _path(self, text):
+        if self._config_key is None:
+            _import_markdown()
+            self._config_key = json.dumps(
+                [CACHE_FORMAT, markdown.__version__,
+                 self.extensions, self.extension_configs],
+                sort_keys=True)
+        import hashlib
+
+        digest = hashlib.sha256(
+            (self._config_key + '\0' + text).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_directory, digest[:2], digest)
+
+    def _load(self, text):
+        try:
+            with open(self._path(text), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, text, result):
+        path = self._path(text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written atomically so that concurrent builds never see a
+        # partially written entry.
+        with output_files.atomic_open(path, encoding='utf-8') as f:
+            f.write(result)
+
+
+def _import_markdown():
+    global markdown
+    import markdown
+
+
+def inline_fragment(html):
+    '''Strip the <p> wrapper markdown puts around a single paragraph.'''
+    if html.startswith('<p>') and html.endswith('</p>'):
+        return html[3:-4]
+    return html
+
+
+renderer = MarkdownRenderer()
+
+
+def configure(**kwargs):
+    '''Replace the module renderer with one built from kwargs.'''
+    global renderer
+    renderer = MarkdownRenderer(**kwargs)
+    return renderer
+
+
+def render(text):
+    return renderer.render(text)
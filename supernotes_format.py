@@ -1,120 +1,180 @@
 #!/usr/bin/env python3
 
 
+import argparse
+import collections
 import json
 import os
 import re
 import sys
 
 
+import content_file
+import instrumentation
+import map_clusters
+import output_files
+from content_file import content_paths, load
+from instrumentation import profiler
+
+
+# orjson, when installed, is only imported once something is encoded,
+# keeping it out of the startup of every script.
+orjson = None
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def encode(value):
+    '''
+    Yield the JSON encoding of value in chunks.
+
+    Uses orjson when it is installed and the standard library's
+    incremental encoder otherwise.
+    '''
+    if _import_orjson():
+        yield orjson.dumps(value).decode('utf-8')
+    else:
+        yield from _encoder.iterencode(value)
+
+
+def _import_orjson():
+    '''Import orjson if it is installed, returning whether it is.'''
+    global orjson
+    if orjson is None:
+        try:
+            import orjson
+        except ImportError:
+            orjson = False
+    return orjson is not False
+
+
+# Maps each kind of supernote to the class collecting that kind on a
+# paragraph, in the order the kinds are written out.
+NOTE_SETS = {}
+
+
+def register_note_set(key):
+    """Class decorator registering the class for notes of kind key."""
+    def register(cls):
+        NOTE_SETS[key] = cls
+        return cls
+    return register
+
+
 class SupernotesCollection:
     """Collects all of the supernotes associated with an article."""
 
     short_reference = None
     volume = None
     number = None
-    paragraphs = []
+    paragraphs = None
+    unknown_types = None
+    consolidate_maps = False
 
-    def __init__(self, file, volume, number):
+    def __init__(self, file, volume, number, consolidate_maps=False):
         """
         Construct SupernotesCollection.
 
         Use file containing supernotes JSON data and volume and number
-        for issue.
+        for issue. With consolidate_maps, maps are written in the same
+        compact form as web_format's map data island.
         """
         self.short_reference = file.content['metadata']['short-reference']
         self.volume = volume
         self.number = number
+        self.consolidate_maps = consolidate_maps
         self.paragraphs = []
+        self.unknown_types = collections.Counter()
 
-        paragraph_keys = list(file.content['supernotes'].keys())
+        supernotes = file.content['supernotes']
+        paragraph_keys = list(supernotes.keys())
         # Want the numerical sort order, not string order
         paragraph_keys = [int(x) for x in paragraph_keys]
         paragraph_keys.sort()
 
         for element in paragraph_keys:
-            paragraph_collection = file.content['supernotes'][str(element)]
+            paragraph_collection = supernotes[str(element)]
 
             self.paragraphs.append(
                 Paragraph(paragraph_collection, element, self))
 
+    def warnings(self):
+        """Return messages about problems found while building."""
+        if not self.unknown_types:
+            return []
+        return ['skipped unknown supernotes: {}'.format(', '.join(
+            '{} ({})'.format(name, n)
+            for name, n in sorted(self.unknown_types.items())))]
+
     def generate_supernotes(self):
-        result = ''
-        result += '[\n'
+        return ''.join(self.chunks())
+
+    def chunks(self):
+        """
+        Yield supernotes.json in chunks, one paragraph at a time.
+
+        Only a single paragraph's notes are ever encoded at once.
+        """
+        yield '[\n'
+        separator = ''
         for p in self.paragraphs:
-            result += p.output()
-        result = result[:-2] + '\n'
-        result += ']'
+            yield separator
+            yield from encode(p.to_dict())
+            separator = ',\n'
+        yield '\n]'
 
-        return result
+    def output(self, directory='.'):
+        """
+        Cycle through paragraphs and output them.
 
-    def output(self):
-        """Cycle through paragraphs and output them."""
-        issue_directory = "issue-{}-{}".format(self.volume, self.number)
-        try:
-            os.mkdir(issue_directory)
-        except Exception:
-            pass
-        os.chdir(issue_directory)
+        Writes issue-{volume}-{number}/{short_reference}/supernotes.json
+        below directory and returns its path.
+        """
+        article_directory = output_files.article_directory(
+            directory, self.volume, self.number, self.short_reference)
 
-        try:
-            os.mkdir(self.short_reference)
-        except Exception:
-            pass
-        os.chdir(self.short_reference)
+        path = os.path.join(article_directory, 'supernotes.json')
+        with output_files.atomic_open(path, encoding='utf-8') as f:
+            f.writelines(self.chunks())
 
-        f = open('supernotes.json', 'w')
-        f.write(self.generate_supernotes())
-        f.close()
+        return path
 
 
 class Paragraph:
     """Collects all supernotes on a paragraph identified by number."""
 
-    collection = None
-    content = None
-    number = None
-    notes = []
+    __slots__ = ('collection', 'number', 'notes')
 
     def __init__(self, data, number, collection):
         """
         Construct Paragraph.
 
         Take data and append appropriate set of supernotes to notes list.
+        Kinds of notes missing from NOTE_SETS are counted in the
+        collection's unknown_types.
         """
         self.number = number
         self.collection = collection
         self.notes = []
 
-        ordered_keys = [['commentary', CommentarySet],
-                        ['citation', CitationSet],
-                        ['image', ImageSet],
-                        ['map', MapSet],
-                        ['link', LinkSet],
-                        ['video', VideoSet]]
+        for key, note_set in NOTE_SETS.items():
+            if key in data:
+                self.notes.append(note_set(data[key], collection))
 
-        for key in ordered_keys:
-            if key[0] in data:
-                self.notes.append(
-                    key[1](data[key[0]], collection))
+        if len(self.notes) < len(data):
+            for key in data:
+                if key not in NOTE_SETS:
+                    collection.unknown_types[key] += 1
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"paragraph": {},\n'.format(self.number)
-        result += '"notes": [\n'
-        for note in self.notes:
-            result += note.output()
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'paragraph': self.number,
+                'notes': [note.to_dict() for note in self.notes]}
 
 
+@register_note_set('commentary')
 class CommentarySet:
-    collection = None
-    content = []
+    __slots__ = ('collection', 'content')
 
     def __init__(self, data, collection):
         self.collection = collection
@@ -123,23 +183,13 @@ class CommentarySet:
         for comment in data:
             self.content.append(comment)
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"type": "commentary",\n'
-        result += '"notes": [\n'
-        for element in self.content:
-            result += '"{}",\n'.format(element)
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'type': 'commentary', 'notes': list(self.content)}
 
 
+@register_note_set('citation')
 class CitationSet:
-    collection = None
-    content = []
+    __slots__ = ('collection', 'content')
 
     def __init__(self, data, collection):
         self.collection = collection
@@ -148,23 +198,13 @@ class CitationSet:
         for citation in data:
             self.content.append(citation)
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"type": "citation",\n'
-        result += '"notes": [\n'
-        for element in self.content:
-            result += '"{}",\n'.format(element)
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'type': 'citation', 'notes': list(self.content)}
 
 
+@register_note_set('image')
 class ImageSet:
-    collection = None
-    content = []
+    __slots__ = ('collection', 'content')
 
     def __init__(self, data, collection):
         self.collection = collection
@@ -173,28 +213,20 @@ class ImageSet:
             self.content.append(
                 Image(image, collection))
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"type": "image",\n'
-        result += '"notes": [\n'
-        for element in self.content:
-            result += element.output()
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'type': 'image',
+                'notes': [element.to_dict() for element in self.content]}
 
 
 class Image:
-    collection = None
-    url = None
-    alt = None
-    credit = None
-    caption = None
+    __slots__ = ('collection', 'url', 'alt', 'credit', 'caption')
 
     def __init__(self, data, collection):
+        self.collection = collection
+        self.url = None
+        self.alt = None
+        self.credit = None
+        self.caption = None
         for field in ['url-format', 'alt', 'credit', 'caption']:
             if field in data:
                 if field == 'url-format':
@@ -202,21 +234,16 @@ class Image:
                 else:
                     setattr(self, field, data[field])
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"url": "{}",\n'.format(self.url)
-        result += '"alt": "{}",\n'.format(self.alt)
-        result += '"caption": "{}",\n'.format(self.caption)
-        result += '"credit": "{}"\n'.format(self.credit)
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'url': self.url,
+                'alt': self.alt,
+                'caption': self.caption,
+                'credit': self.credit}
 
 
+@register_note_set('map')
 class MapSet:
-    collection = None
-    content = []
+    __slots__ = ('collection', 'content')
 
     def __init__(self, data, collection):
         self.collection = collection
@@ -225,66 +252,60 @@ class MapSet:
             self.content.append(
                 Map(map, collection))
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"type": "map",\n'
-        result += '"notes": [\n'
-        for element in self.content:
-            result += element.output()
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'type': 'map',
+                'notes': [element.to_dict() for element in self.content]}
 
 
 class Map:
-    collection = None
-    tileset = None
-    center = {}
-    zoom = None
-    minZoom = None
-    maxZoom = None
-    markers = []
+    __slots__ = ('collection', 'tileset', 'center', 'zoom', 'minZoom',
+                 'maxZoom', 'markers')
 
     def __init__(self, data, collection):
+        self.collection = collection
         for field in ['tileset', 'center', 'zoom',
                       'minZoom', 'maxZoom', 'markers']:
             setattr(self, field, data[field])
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"tileset": "{}",\n'.format(self.tileset)
-        result += '"center": {\n'
-        result += '"longitude": "{}",\n'.format(self.center['longitude'])
-        result += '"latitude": "{}",\n'.format(self.center['latitude'])
-        result += '},\n'
-        result += '"zoom": "{}",\n'.format(self.zoom)
-        result += '"minZoom": "{}",\n'.format(self.minZoom)
-        result += '"maxZoom": "{}",\n'.format(self.maxZoom)
-        result += '"markers": [\n'
-        for marker in self.markers:
-            result += '{\n'
-            result += '"position": {\n'
-            result += '"longitude": "{}",\n'.format(
-                marker['position']['longitude'])
-            result += '"latitude": "{}"\n'.format(
-                marker['position']['latitude'])
-            result += '},\n'
-            result += '"message": "{}"\n'.format(marker['message'])
-            result += '},\n'
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
-
-
+    def to_dict(self):
+        if self.collection.consolidate_maps:
+            # Markers are [latitude, longitude, message] arrays, with
+            # numbers kept as numbers, and the map's bounds and clusters
+            # are added as for web_format's maps.
+            markers = [[marker['position']['latitude'],
+                        marker['position']['longitude'],
+                        marker['message']]
+                       for marker in self.markers]
+            return {'tileset': self.tileset,
+                    'center': [self.center['latitude'],
+                               self.center['longitude']],
+                    'zoom': self.zoom,
+                    'minZoom': self.minZoom,
+                    'maxZoom': self.maxZoom,
+                    'markers': markers,
+                    **map_clusters.marker_data(
+                        [marker[:2] for marker in markers],
+                        self.minZoom, self.maxZoom)}
+
+        # Numbers are emitted as strings, as consumers of supernotes.json
+        # have always received them.
+        return {'tileset': self.tileset,
+                'center': {'longitude': str(self.center['longitude']),
+                           'latitude': str(self.center['latitude'])},
+                'zoom': str(self.zoom),
+                'minZoom': str(self.minZoom),
+                'maxZoom': str(self.maxZoom),
+                'markers': [
+                    {'position': {
+                        'longitude': str(marker['position']['longitude']),
+                        'latitude': str(marker['position']['latitude'])},
+                     'message': marker['message']}
+                    for marker in self.markers]}
+
+
+@register_note_set('link')
 class LinkSet:
-    collection = None
-    content = []
+    __slots__ = ('collection', 'content')
 
     def __init__(self, data, collection):
         self.collection = collection
@@ -293,43 +314,26 @@ class LinkSet:
             self.content.append(
                 Link(link, collection))
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"type": "link",\n'
-        result += '"notes": [\n'
-        for element in self.content:
-            result += element.output()
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'type': 'link',
+                'notes': [element.to_dict() for element in self.content]}
 
 
 class Link:
-    collection = None
-    label = None
-    url = None
+    __slots__ = ('collection', 'label', 'url')
 
     def __init__(self, data, collection):
         self.collection = collection
         self.label = data['label']
         self.url = data['url']
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"label": "{}",\n'.format(self.label)
-        result += '"url": "{}"\n'.format(self.url)
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'label': self.label, 'url': self.url}
 
 
+@register_note_set('video')
 class VideoSet:
-    collection = None
-    content = []
+    __slots__ = ('collection', 'content')
 
     def __init__(self, data, collection):
         self.collection = collection
@@ -338,79 +342,89 @@ class VideoSet:
             self.content.append(
                 Video(video, collection))
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"type": "video",\n'
-        result += '"notes": [\n'
-        for element in self.content:
-            result += element.output()
-        result = result[:-2] + '\n'
-        result += ']\n'
-        result += '},\n'
-
-        return result
+    def to_dict(self):
+        return {'type': 'video',
+                'notes': [element.to_dict() for element in self.content]}
 
 
 class Video:
-    collection = None
-    service = None
-    id = None
-    width = None
-    height = None
-    caption = None
+    __slots__ = ('collection', 'service', 'id', 'width', 'height',
+                 'caption')
 
     def __init__(self, data, collection):
         self.collection = collection
         for field in ['service', 'id', 'width', 'height', 'caption']:
             setattr(self, field, data[field])
 
-    def output(self):
-        result = ''
-        result += '{\n'
-        result += '"service": "{}",\n'.format(self.service)
-        result += '"id": "{}",\n'.format(self.id)
-        result += '"width": "{}",\n'.format(self.width)
-        result += '"height": "{}",\n'.format(self.height)
-        result += '"caption": "{}"\n'.format(self.caption)
-        result += '},\n'
-
-        return result
-
-
-class ContentFile:
-    stream = None
-    content = None
-
-    def __init__(self, stream):
-        self.stream = stream
-        self.content = json.loads(self.stream.read())
+    def to_dict(self):
+        return {'service': self.service,
+                'id': str(self.id),
+                'width': str(self.width),
+                'height': str(self.height),
+                'caption': self.caption}
 
 
 if __name__ == '__main__':
-    content_files = []
-    skipped_names = [
-        'contributors', 'cover.jpg', 'bundle.json',
-        'cover-chapter-1.jpg', 'cover-chapter-2.jpg',
-        'cover-chapter-3.jpg']
-    volume = None
-    number = None
-
-    for idx, arg in enumerate(sys.argv):
-        if idx == 0:
-            pass
-        elif idx == 1:
-            volume = arg
-        elif idx == 2:
-            number = arg
-        else:
-            name = arg.split('/')[-1]
-            if name not in skipped_names:
-                content_files.append(ContentFile(open(arg)))
+    parser = argparse.ArgumentParser(
+        description='Generate supernotes.json files for an issue.')
+    parser.add_argument('volume', help='volume number')
+    parser.add_argument('number', help='issue number')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='path(s) to JSON files for article content')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip content files which are unchanged '
+                        'since the last build')
+    parser.add_argument('--stream', action='store_true',
+                        help='read content files incrementally (needs '
+                        'ijson)')
+    parser.add_argument('--consolidate-maps', action='store_true',
+                        help='write maps with compact [latitude, '
+                        'longitude, message] markers')
+    content_file.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    content_file.configure(args)
+    instrumentation.configure(args)
+    volume = args.volume
+    number = args.number
+
+    paths = content_paths(args.paths)
 
     current_directory = os.getcwd()
-    for file in content_files:
-        os.chdir(current_directory)
-        if 'supernotes' in file.content:
-            collection = SupernotesCollection(file, volume, number)
-            collection.output()
+    if args.incremental:
+        import build_manifest
+
+        manifest = build_manifest.BuildManifest(
+            os.path.join(current_directory,
+                         'issue-{}-{}'.format(volume, number)),
+            'supernotes_format',
+            build_manifest.generator_version(
+                __file__, map_clusters.__file__, content_file.__file__) +
+            ('-consolidated-maps' if args.consolidate_maps else ''))
+
+    for path in paths:
+        if args.incremental:
+            digest = build_manifest.file_digest(path)
+            if manifest.is_current(path, digest):
+                continue
+
+        with profiler.profiled():
+            file = load(path, args.stream)
+            outputs = []
+            if 'supernotes' in file.content:
+                with profiler.stage('SupernotesCollection.__init__'):
+                    collection = SupernotesCollection(
+                        file, volume, number, args.consolidate_maps)
+                with profiler.stage('SupernotesCollection.output'):
+                    outputs.append(collection.output(current_directory))
+                for warning in collection.warnings():
+                    sys.stderr.write('{}: {}\n'.format(path, warning))
+
+        if args.incremental:
+            manifest.record(path, digest, outputs)
+
+    if args.incremental:
+        manifest.save()
+
+    if profiler.enabled:
+        sys.stderr.write(profiler.summary())
@@ -1,30 +1,160 @@
 #!/usr/bin/env python3
 
 
+import argparse
+import collections
+import itertools
 import json
 import os
 import re
+import string
 import sys
-
-
-import markdown
+import time
+import traceback
+
+
+import content_file
+import instrumentation
+import map_clusters
+import output_files
+import rendering
+from content_file import content_paths, load
+from instrumentation import profiler
+
+
+# Maps the type of each content element to the callable that builds its
+# element object from (data, article); the object's chunks() renders it.
+ELEMENT_TYPES = {}
+
+
+def register_element(types, factory=None):
+    '''
+    Class decorator registering the class for the given element types.
+
+    factory, if given, is registered instead of the class itself, for
+    elements which need more than (data, article) to be built.
+    '''
+    def register(cls):
+        for element_type in types:
+            ELEMENT_TYPES[element_type] = factory or cls
+        return cls
+    return register
+
+
+def compile_template(template, *fields, **constants):
+    '''
+    Compile template into a function filling its fields positionally.
+
+    template uses named fields; the function takes their values in the
+    order given by fields, since positional formatting is about twice as
+    fast as formatting by keyword. Fields named in constants are filled
+    in once, here.
+    '''
+    parts = []
+    for literal, name, _, _ in string.Formatter().parse(template):
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if name is None:
+            continue
+        if name in constants:
+            parts.append(str(constants[name])
+                         .replace('{', '{{').replace('}', '}}'))
+        else:
+            parts.append('{{{}}}'.format(fields.index(name)))
+    return ''.join(parts).format
+
+
+# Map markers and gallery items are rendered this many at a time.
+ITEM_BATCH_SIZE = 512
+
+
+def batches(items, size=ITEM_BATCH_SIZE):
+    '''Yield lists of up to size consecutive items.'''
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Link tokens are looked for where their first this many characters
+# appear.
+LINK_PREFIX_LENGTH = 3
+
+
+def prefix_pattern(prefixes):
+    '''
+    Return a regular expression matching any of prefixes.
+
+    The prefixes are arranged in a trie, so that a position in the text
+    is ruled out after a character or so rather than after trying every
+    prefix in turn.
+    '''
+    trie = {}
+    for prefix in prefixes:
+        node = trie
+        for character in prefix:
+            node = node.setdefault(character, {})
+        node[''] = None
+    return _trie_pattern(trie)
+
+
+def _trie_pattern(node):
+    literal = []
+    # A run of characters with nothing branching off is one literal.
+    while len(node) == 1 and '' not in node:
+        (character, node), = node.items()
+        literal.append(character)
+    prefix = re.escape(''.join(literal))
+    branches = [re.escape(character) + _trie_pattern(child)
+                for character, child in node.items() if character]
+    if not branches:
+        return prefix
+    group = '(?:{})'.format('|'.join(branches))
+    if '' in node:
+        group += '?'
+    return prefix + group
 
 
 class Article:
     ''''''
     title = None
-    authors = []
+    authors = None
     short_reference = None
     volume = None
     number = None
     toc = None
     chapter = None
     excerpt = None
-    contents = []
-    supernotes = []
-
-    def __init__(self, file, volume, number):
-        self.contents = []
+    contents = None
+    supernotes = None
+    map_count = 0
+    unknown_types = None
+    link_problems = None
+    link_prefixes = None
+    link_pattern = None
+    anchors = None
+    links = None
+    image_prefix = None
+    consolidate_maps = False
+    maps = None
+    table_count = 0
+    table_page_rows = None
+    sidecars = None
+
+    def __init__(self, file, volume, number, consolidate_maps=False,
+                 table_page_rows=None):
+        self.map_count = 0
+        self.consolidate_maps = consolidate_maps
+        self.maps = []
+        self.table_count = 0
+        self.table_page_rows = table_page_rows
+        self.sidecars = []
+        self.unknown_types = collections.Counter()
+        self.link_problems = []
+        self.link_prefixes = set()
+        self.anchors = []
+        self.links = []
         self.title = file.content['metadata']['title']
         if 'author' in file.content['metadata']:
             self.authors = file.content['metadata']['author']
@@ -38,131 +168,335 @@ class Article:
             self.excerpt = file.content['metadata']['summary']
         self.volume = volume
         self.number = number
-
-        map_counter = 0
-        for element in file.content['content']:
-            if element['type'] in \
-                ['paragraph', 'editorial-intro-paragraph',
-                    'alt-voice-paragraph', 'blockquote',
-                    'stage-direction-paragraph']:
-                self.contents.append(Paragraph(element, self))
-            elif element['type'] == 'image':
-                self.contents.append(Image(element, self))
-            elif element['type'] in ['major-divider', 'minor-divider']:
-                self.contents.append(Divider(element, self))
-            elif element['type'] in ['major-header', 'minor-header']:
-                self.contents.append(Header(element, self))
-            elif element['type'] == 'anvil-gallery':
-                self.contents.append(ImageGallery(element, self))
-            elif element['type'] == 'audio':
-                self.contents.append(Audio(element, self))
-            elif element['type'] == 'video':
-                self.contents.append(Video(element, self))
-            elif element['type'] == 'table':
-                self.contents.append(Table(element, self))
-            elif element['type'] == 'map':
-                self.contents.append(Map(element, map_counter, self))
-                map_counter += 1
-
-    def output(self):
-        issue_directory = "issue-{}-{}".format(self.volume, self.number)
-        try:
-            os.mkdir(issue_directory)
-        except Exception:
-            pass
-        os.chdir(issue_directory)
-
-        try:
-            os.mkdir(self.short_reference)
-        except Exception:
-            pass
-        os.chdir(self.short_reference)
-
-        f = open('web_content.html', 'w')
+        self.image_prefix = '/images/issues/{}/{}/'.format(volume, number)
+
+        # Elements of a streamed content file are built one at a time as
+        # they are written out, so contents can only be iterated once.
+        self.contents = self.build_contents(file.content['content'])
+        if not getattr(file, 'streaming', False):
+            self.contents = list(self.contents)
+
+    def build_contents(self, elements):
+        '''
+        Yield an element object for each content element.
+
+        Elements of types missing from ELEMENT_TYPES are left out and
+        counted in unknown_types.
+        '''
+        for element in elements:
+            factory = ELEMENT_TYPES.get(element['type'])
+            if factory is None:
+                self.unknown_types[element['type']] += 1
+                continue
+            start = time.perf_counter()
+            built = factory(element, self)
+            if profiler.enabled:
+                profiler.add(type(built).__name__ + '.__init__',
+                             time.perf_counter() - start)
+            yield built
+
+    def next_map_id(self):
+        map_id = self.map_count
+        self.map_count += 1
+        return map_id
+
+    def next_table_id(self):
+        table_id = self.table_count
+        self.table_count += 1
+        return table_id
+
+    def add_link_tokens(self, internal_links):
+        '''
+        Add a paragraph's internal link tokens to the article's lookups.
+
+        The article keeps the distinct prefixes of all its tokens; the
+        pattern finding them is recompiled, when next needed, only if a
+        new one is added.
+        '''
+        for internal_link in internal_links:
+            prefix = internal_link['token'][:LINK_PREFIX_LENGTH]
+            if prefix not in self.link_prefixes:
+                self.link_prefixes.add(prefix)
+                self.link_pattern = None
+
+    def substitute_links(self, text, internal_links, number):
+        '''
+        Replace a paragraph's internal link tokens in text in one pass.
+
+        Candidates are found with the article's prefix pattern, and the
+        text at each is looked up among the paragraph's own tokens,
+        longest first; tokens of other paragraphs are left alone. Tokens which
+        are missing from the text, or which contain another token of the
+        paragraph, are recorded in link_problems.
+        '''
+        replacements = {}
+        for internal_link in internal_links:
+            # As with sequential replacement, the first link wins.
+            replacements.setdefault(internal_link['token'],
+                                    internal_link['web'])
+
+        if len(replacements) > 1:
+            # Each token is counted once per token containing it, so a
+            # count above one means it is inside another token.
+            joined = '\0'.join(replacements)
+            for other in replacements:
+                if joined.count(other) > 1:
+                    for token in replacements:
+                        if other != token and other in token:
+                            self.link_problems.append(
+                                'paragraph {}: link token {!r} overlaps {!r}'
+                                .format(number, token, other))
+
+        if len(replacements) == 1:
+            # One token needs no pattern; str.replace is a single pass.
+            (token, web), = replacements.items()
+            if token not in text:
+                self.link_problems.append(
+                    'paragraph {}: link token {!r} not found'
+                    .format(number, token))
+            return text.replace(token, web)
+
+        if self.link_pattern is None:
+            self.link_pattern = re.compile(
+                prefix_pattern(self.link_prefixes))
+
+        lengths = sorted({len(token) for token in replacements},
+                         reverse=True)
+        pieces = []
+        found = set()
+        end = 0
+        for match in self.link_pattern.finditer(text):
+            # finditer skips prefixes overlapping the one it found, so
+            # when no token starts there, the positions within it are
+            # tried as well.
+            for start in range(match.start(), match.end()):
+                if start < end:
+                    continue
+                for length in lengths:
+                    token = text[start:start + length]
+                    if token in replacements:
+                        break
+                else:
+                    continue
+                pieces.append(text[end:start])
+                pieces.append(replacements[token])
+                found.add(token)
+                end = start + length
+                break
+        pieces.append(text[end:])
+
+        for token in replacements:
+            if token not in found:
+                self.link_problems.append(
+                    'paragraph {}: link token {!r} not found'
+                    .format(number, token))
+
+        return ''.join(pieces)
+
+    def index_entry(self):
+        '''
+        Return the article's entry for a link_index.LinkIndex.
+
+        Elements add their anchor ids and internal links as they are
+        built, so this is complete once the article has been written.
+        '''
+        return {'short_reference': self.short_reference,
+                'volume': self.volume,
+                'number': self.number,
+                'anchors': self.anchors,
+                'links': self.links}
+
+    def warnings(self):
+        '''Return messages about problems found while building.'''
+        messages = []
+        if self.unknown_types:
+            messages.append('skipped unknown elements: {}'.format(
+                format_counts(self.unknown_types)))
+        return messages + self.link_problems
+
+    def output(self, directory='.'):
+        '''
+        Write web_content.html and metadata.yml for the article.
+
+        Files go to issue-{volume}-{number}/{short_reference} below
+        directory and are replaced atomically, so an interrupted build
+        never leaves a partly written file. The JSON sidecars of paged
+        tables are written alongside, and any left by an earlier build
+        with more pages, or with paging, are removed. Returns the paths
+        written.
+        '''
+        article_directory = output_files.article_directory(
+            directory, self.volume, self.number, self.short_reference)
+
+        content_path = os.path.join(article_directory, 'web_content.html')
+        with output_files.atomic_open(content_path) as f:
+            self.write_content(f)
+
+        metadata_path = os.path.join(article_directory, 'metadata.yml')
+        with profiler.stage('write'):
+            self.write_metadata(metadata_path)
+
+        outputs = [content_path, metadata_path]
+        with profiler.stage('write'):
+            for name, rows in self.sidecars:
+                path = os.path.join(article_directory, name)
+                with output_files.atomic_open(path, encoding='utf-8') as f:
+                    json.dump([[str(cell) for cell in row] for row in rows],
+                              f, ensure_ascii=False, separators=(',', ':'))
+                outputs.append(path)
+            current = {name for name, _ in self.sidecars}
+            for name in os.listdir(article_directory):
+                if TABLE_SIDECAR.match(name) and name not in current:
+                    os.unlink(os.path.join(article_directory, name))
+        return outputs
+
+    def write_metadata(self, metadata_path):
+        with output_files.atomic_open(metadata_path) as f:
+            f.write('---\n')
+            f.write('layout: article\n')
+            f.write('title: {}\n'.format(self.title))
+            f.write('authors:\n')
+            f.write('excerpt: >\n')
+            f.write('\t{}\n'.format(self.excerpt))
+            f.write('permalink: \n')
+            f.write('toc: {}\n'.format(self.toc))
+            if self.chapter:
+                f.write('chapter: {}\n'.format(self.chapter))
+            f.write('volume: {}\n'.format(self.volume))
+            f.write('number: {}\n'.format(self.number))
+            f.write('---\n')
+
+    def write_content(self, stream):
+        '''
+        Stream the HTML for every element to stream.
+
+        Elements yield their markup in chunks, so no element or page is
+        ever held in memory as a single string.
+        '''
         for element in self.contents:
-            f.write(element.output())
-            f.write('\n\n')
-        f.close()
-
-        f = open('metadata.yml', 'w')
-        f.write('---\n')
-        f.write('layout: article\n')
-        f.write('title: {}\n'.format(self.title))
-        f.write('authors:\n')
-        f.write('excerpt: >\n')
-        f.write('\t{}\n'.format(self.excerpt))
-        f.write('permalink: \n')
-        f.write('toc: {}\n'.format(self.toc))
-        if self.chapter:
-            f.write('chapter: {}\n'.format(self.chapter))
-        f.write('volume: {}\n'.format(self.volume))
-        f.write('number: {}\n'.format(self.number))
-        f.write('---\n')
-        f.close()
-
-
+            if profiler.enabled:
+                # Render and write separately so the two can be told
+                # apart in the profile.
+                with profiler.stage(type(element).__name__ + '.output'):
+                    chunks = list(element.chunks())
+                with profiler.stage('write'):
+                    stream.writelines(chunks)
+                    stream.write('\n\n')
+            else:
+                stream.writelines(element.chunks())
+                stream.write('\n\n')
+
+        if self.maps:
+            with profiler.stage('Map.output'):
+                stream.writelines(self.map_chunks())
+
+        if self.sidecars:
+            stream.write(TABLE_LOADER)
+
+    def map_chunks(self):
+        '''
+        Yield the data island and initializer for consolidated maps.
+
+        Every map's settings and markers go into one JSON script element,
+        which a single script turns into Leaflet maps, instead of each
+        map carrying its own script.
+        '''
+        data = json.dumps([leaflet_map.to_data() for leaflet_map in self.maps],
+                          ensure_ascii=False, separators=(',', ':'))
+        # Escaped so that no '</script' or '<!--' in a message can end
+        # the script element early.
+        yield MAP_DATA_TEMPLATE(data.replace('<', '\\u003c'))
+        yield MAP_INITIALIZER
+
+
+# Markup for each paragraph style, filled with the number and content.
+PARAGRAPH_WRAPPERS = {
+    style: '<div class="paragraph-pack">{}</div>'.format(wrapper)
+    for style, wrapper in [
+        ('paragraph', '<p id="paragraph-{}">\n{}\n</p>'),
+        ('editorial-intro-paragraph',
+         '<p id="paragraph-{}" class="editorial-intro">\n{}\n</p>'),
+        ('blockquote',
+         '<blockquote id="paragraph-{}">\n<p>\n{}\n</p>\n</blockquote>'),
+        ('alt-voice-paragraph',
+         '<p id="paragraph-{}" class="alternate-voice">\n{}\n</p>'),
+        ('stage-direction-paragraph',
+         '<p id="paragraph-{}" class="stage-direction">\n{}\n</p>')]}
+
+
+@register_element(PARAGRAPH_WRAPPERS)
 class Paragraph:
-    article = None
-    content = None
-    number = None
-    style = None
-    internal_links = None
+    __slots__ = ('article', 'content', 'number', 'style', 'internal_links')
 
     def __init__(self, data, article):
-        self.content = markdown.markdown(data['content'])[3:-4]
+        self.internal_links = None
+        self.content = rendering.render(data['content'])
         self.number = int(data['number'])
         self.article = article
         self.style = data['type']
         if 'internal-links' in data:
             self.internal_links = data['internal-links']
+            article.links.extend((self.number, internal_link['web'])
+                                 for internal_link in self.internal_links)
+            article.add_link_tokens(self.internal_links)
+        article.anchors.append('paragraph-{}'.format(self.number))
 
-    def output(self):
-        result = '<!-- {} -->\n'.format(self.number)
-        if self.style == 'editorial-intro-paragraph':
-            wrapper = '<p id="paragraph-{}" class="editorial-intro">\n{}\n</p>'
-        elif self.style == 'blockquote':
-            wrapper = '<blockquote id="paragraph-{}">\n<p>\n{}\n</p>\n' \
-                '</blockquote>'
-        elif self.style == 'alt-voice-paragraph':
-            wrapper = '<p id="paragraph-{}" class="alternate-voice">\n{}\n</p>'
-        elif self.style == 'stage-direction-paragraph':
-            wrapper = '<p id="paragraph-{}" class="stage-direction">\n{}\n</p>'
-        else:
-            wrapper = '<p id="paragraph-{}">\n{}\n</p>'
+    def chunks(self):
+        yield '<!-- {} -->\n'.format(self.number)
+        wrapper = PARAGRAPH_WRAPPERS.get(
+            self.style, PARAGRAPH_WRAPPERS['paragraph'])
 
-        wrapper = '<div class="paragraph-pack">{}</div>'.format(wrapper)
-        
-        result += wrapper.format(self.number, self.content)
+        result = wrapper.format(self.number, self.content)
 
         if self.internal_links:
-            for internal_link in self.internal_links:
-                result = result.replace(
-                    internal_link['token'],
-                    internal_link['web'])
+            result = self.article.substitute_links(
+                result, self.internal_links, self.number)
 
-        return result
+        yield result
+
+    def output(self):
+        return ''.join(self.chunks())
+
+
+AUDIO_TEMPLATE = compile_template(
+    '<div class="inline-audio">'
+    '<a href="/audio{url}" class="sm2_button">{label}</a>'
+    '<p class="label">{label}</p>'
+    '</div>',
+    'url', 'label')
 
 
+@register_element(['audio'])
 class Audio:
-    article = None
+    __slots__ = ('article', 'url', 'label')
 
     def __init__(self, data, article):
         self.article = article
         self.url = data['url'][45:]
-        self.label = markdown.markdown(data['label'])[3:-4]
+        self.label = rendering.render(data['label'])
+
+    def chunks(self):
+        yield AUDIO_TEMPLATE(self.url, self.label)
 
     def output(self):
-        result = '<div class="inline-audio">'
-        result += '<a href="/audio{}" class="sm2_button">{}</a>' \
-            .format(self.url, self.label)
-        result += '<p class="label">{}</p>'.format(self.label)
-        result += '</div>'
+        return ''.join(self.chunks())
+
 
-        return result
+VIDEO_TEMPLATE = compile_template(
+    '<div class="inline-video">\n'
+    '<iframe width="{width}" height="{height}" '
+    'src="https://www.youtube.com/embed/{id}'
+    '?rel=0&amp;showinfo=0" frameborder="0" '
+    'allowfullscreen></iframe>\n'
+    '{caption}'
+    '</div>\n',
+    'width', 'height', 'id', 'caption')
+CAPTION_TEMPLATE = '<p class="caption">{}</p>\n'.format
 
 
+@register_element(['video'])
 class Video:
-    article = None
+    __slots__ = ('article', 'video_id', 'width', 'height', 'caption')
 
     def __init__(self, data, article):
         self.article = article
@@ -170,33 +504,140 @@ class Video:
         self.width = data['width']
         self.height = data['height']
         if 'caption' in data:
-            self.caption = markdown.markdown(data['caption'])[3:-4]
+            self.caption = rendering.render(data['caption'])
         else:
             self.caption = None
 
-    def output(self):
-        result = '<div class="inline-video">\n'
-        result += '<iframe width="{}" height="{}" ' \
-            .format(self.width, self.height)
-        result += 'src="https://www.youtube.com/embed/{}'.format(self.video_id)
-        result += '?rel=0&amp;showinfo=0" frameborder="0" '
-        result += 'allowfullscreen></iframe>\n'
-        if self.caption and len(self.caption) > 0:
-            result += '<p class="caption">{}</p>\n'.format(self.caption)
-        result += '</div>\n'
-
-        return result
-
+    def chunks(self):
+        yield VIDEO_TEMPLATE(
+            self.width, self.height, self.video_id,
+            CAPTION_TEMPLATE(self.caption) if self.caption else '')
 
+    def output(self):
+        return ''.join(self.chunks())
+
+
+STAMEN_ATTRIBUTION = (
+    "'Map tiles by <a href=\"http://stamen.com\">Stamen Design</a>, "
+    "under <a href=\"http://creativecommons.org/licenses/by/3.0\">"
+    "CC BY 3.0</a>. Data by <a href=\"http://openstreetmap.org\">"
+    "OpenStreetMap</a>, under <a href=\"http://creativecommons.org/"
+    "licenses/by-sa/3.0\">CC BY SA</a>.'")
+
+MAP_INITIALIZATION_TEMPLATE = compile_template(
+    'var leaflet_map_id_{id} = "map-container-{id}";\n'
+    'var leaflet_layer_{id} = new L.StamenTileLayer("{tileset}");\n'
+    'var leaflet_map_{id} = L.map(leaflet_map_id_{id}, {{\n'
+    'center: new L.LatLng({latitude}, {longitude}), '
+    'zoom: {zoom}, minZoom: {minZoom}, maxZoom: {maxZoom}}});\n'
+    'leaflet_map_{id}.attributionControl.addAttribution('
+    '{attribution});\n'
+    'leaflet_map_{id}.addLayer(leaflet_layer_{id});\n',
+    'id', 'tileset', 'latitude', 'longitude', 'zoom', 'minZoom', 'maxZoom',
+    attribution=STAMEN_ATTRIBUTION)
+
+MAP_OPENING_TEMPLATE = (
+    '<div id="map-container-{}" class="inline-leaflet-map" '
+    '                    ></div>\n'
+    '<script type="text/javascript">\n'
+    "$(document).on('ready', function() {{\n").format
+
+MAP_CONTAINER_TEMPLATE = \
+    '<div id="map-container-{}" class="inline-leaflet-map"></div>\n'.format
+
+MAP_DATA_TEMPLATE = \
+    '<script type="application/json" id="leaflet-map-data">{}</script>\n' \
+    .format
+
+# Builds every map in the data island. Each map is also kept in a
+# leaflet_map_{id} global, as with the per-map scripts. Markers are
+# only created once they are drawn; on maps with clusters, what is
+# drawn is redrawn for each clustered zoom level, and clicking a
+# cluster zooms to its cell of map_clusters' grid, worked out from its
+# position as map_clusters does. Above the clustered levels, every
+# marker is added once and left in place.
+MAP_INITIALIZER = (
+    '<script type="text/javascript">\n'
+    "$(document).on('ready', function() {\n"
+    "var maps = JSON.parse("
+    "document.getElementById('leaflet-map-data').textContent);\n"
+    'var cellBounds = function(entry, zoom) {\n'
+    'var cells = ' + str(map_clusters.TILE_PIXELS) +
+    ' * Math.pow(2, zoom) / ' + str(map_clusters.CLUSTER_PIXELS) + ';\n'
+    'var limit = ' + repr(map_clusters.MAXIMUM_LATITUDE) + ';\n'
+    'var sine = Math.sin('
+    'Math.max(-limit, Math.min(limit, entry[0])) * Math.PI / 180);\n'
+    'var column = Math.floor((entry[1] + 180) / 360 * cells);\n'
+    'var row = Math.floor((0.5 - Math.log((1 + sine) / (1 - sine)) / '
+    '(4 * Math.PI)) * cells);\n'
+    'var latitude = function(y) {\n'
+    'var v = Math.PI * (1 - 2 * y / cells);\n'
+    'return Math.atan((Math.exp(v) - Math.exp(-v)) / 2) * 180 / Math.PI;\n'
+    '};\n'
+    'return L.latLngBounds('
+    '[latitude(row + 1), column / cells * 360 - 180], '
+    '[latitude(row), (column + 1) / cells * 360 - 180]);\n'
+    '};\n'
+    'maps.forEach(function(data) {\n'
+    "var map = L.map('map-container-' + data.id, {\n"
+    'center: new L.LatLng(data.center[0], data.center[1]), '
+    'zoom: data.zoom, minZoom: data.minZoom, maxZoom: data.maxZoom});\n'
+    'map.attributionControl.addAttribution(' + STAMEN_ATTRIBUTION + ');\n'
+    'map.addLayer(new L.StamenTileLayer(data.tileset));\n'
+    'var layer = L.layerGroup().addTo(map);\n'
+    'var markers = [];\n'
+    'var marker = function(index) {\n'
+    'var m = data.markers[index];\n'
+    'return markers[index] || (markers[index] = '
+    'L.marker([m[0], m[1]]).bindPopup(m[2]));\n'
+    '};\n'
+    'var all = false;\n'
+    'var draw = function() {\n'
+    'var zoom = map.getZoom();\n'
+    'var entries = data.clusters && data.clusters[zoom];\n'
+    'if (!entries) {\n'
+    'if (!all) {\n'
+    'layer.clearLayers();\n'
+    'data.markers.forEach(function(m, index) '
+    '{ layer.addLayer(marker(index)); });\n'
+    'all = true;\n'
+    '}\n'
+    'return;\n'
+    '}\n'
+    'all = false;\n'
+    'layer.clearLayers();\n'
+    'entries.forEach(function(entry) {\n'
+    "if (typeof entry === 'number') { layer.addLayer(marker(entry)); "
+    'return; }\n'
+    'layer.addLayer(L.marker([entry[0], entry[1]], {icon: L.divIcon('
+    "{className: 'marker-cluster', html: '' + entry[2]})})"
+    ".on('click', function() "
+    '{ map.fitBounds(cellBounds(entry, zoom)); }));\n'
+    '});\n'
+    '};\n'
+    'draw();\n'
+    'if (data.clusters) {\n'
+    "map.on('zoomend', draw);\n"
+    '}\n'
+    "window['leaflet_map_' + data.id] = map;\n"
+    '});\n'
+    '});\n'
+    '</script>\n')
+
+# Compiled for each map, with its id filled in.
+MAP_MARKER_TEMPLATE = \
+    'L.marker([{latitude},{longitude}]).addTo(leaflet_map_{id})' \
+    '.bindPopup("{message}");\n'
+
+MAP_CLOSING = '});\n</script>\n\n'
+
+
+@register_element(
+    ['map'],
+    lambda data, article: Map(data, article.next_map_id(), article))
 class Map:
-    article = None
-    id = None
-    tileset = None
-    center = None
-    zoom = None
-    minZoom = None
-    maxZoom = None
-    markers = None
+    __slots__ = ('article', 'id', 'tileset', 'center', 'zoom', 'minZoom',
+                 'maxZoom', 'markers')
 
     def __init__(self, data, id, article):
         self.article = article
@@ -207,100 +648,196 @@ class Map:
         self.minZoom = data['minZoom']
         self.maxZoom = data['maxZoom']
         self.markers = data['markers']
+        article.anchors.append('map-container-{}'.format(id))
+        if article.consolidate_maps:
+            article.maps.append(self)
 
     def map_initialization(self):
-        result = 'var leaflet_map_id_{} = "map-container-{}";\n' \
-            .format(self.id, self.id)
-        result += 'var leaflet_layer_{} = new L.StamenTileLayer("{}");\n' \
-            .format(self.id, self.tileset)
-        result += 'var leaflet_map_{} = L.map(leaflet_map_id_{}, {{\n' \
-            .format(self.id, self.id)
-        result += 'center: new L.LatLng({}, {}), ' \
-            .format(self.center[0], self.center[1])
-        result += 'zoom: {}, '.format(self.zoom)
-        result += 'minZoom: {}, '.format(self.minZoom)
-        result += 'maxZoom: {}'.format(self.maxZoom)
-        result += '});\n'
-
-        result += "leaflet_map_{}.attributionControl.addAttribution(" \
-            "'Map tiles by <a href=\"http://stamen.com\">Stamen Design</a>, " \
-            "under <a href=\"http://creativecommons.org/licenses/by/3.0\">" \
-            "CC BY 3.0</a>. Data by <a href=\"http://openstreetmap.org\">" \
-            "OpenStreetMap</a>, under <a href=\"http://creativecommons.org/" \
-            "licenses/by-sa/3.0\">CC BY SA</a>.');\n".format(self.id)
-
-        result += 'leaflet_map_{}.addLayer(leaflet_layer_{});\n' \
-            .format(self.id, self.id)
-
-        return result
+        return MAP_INITIALIZATION_TEMPLATE(
+            self.id, self.tileset, self.center[0], self.center[1],
+            self.zoom, self.minZoom, self.maxZoom)
+
+    def to_data(self):
+        '''
+        Return the map's entry in the article's map data island.
+
+        Its bounds, and for large maps its marker clusters, come from
+        map_clusters.marker_data.
+        '''
+        markers = [[mm['position']['latitude'],
+                    mm['position']['longitude'],
+                    mm['message']]
+                   for mm in self.markers]
+        with profiler.stage('map_clusters'):
+            extra = map_clusters.marker_data(
+                [marker[:2] for marker in markers],
+                self.minZoom, self.maxZoom)
+        return {'id': self.id,
+                'tileset': self.tileset,
+                'center': list(self.center),
+                'zoom': self.zoom,
+                'minZoom': self.minZoom,
+                'maxZoom': self.maxZoom,
+                'markers': markers,
+                **extra}
+
+    def chunks(self):
+        if self.article.consolidate_maps:
+            # The map is built by the article's map initializer.
+            yield MAP_CONTAINER_TEMPLATE(self.id)
+            return
+        yield MAP_OPENING_TEMPLATE(self.id)
+        yield self.map_initialization()
+        marker = compile_template(
+            MAP_MARKER_TEMPLATE, 'latitude', 'longitude', 'message',
+            id=self.id)
+        for batch in batches(self.markers):
+            yield ''.join([marker(mm['position']['latitude'],
+                                  mm['position']['longitude'],
+                                  mm['message'])
+                           for mm in batch])
+        yield MAP_CLOSING
 
     def output(self):
-        result = '<div id="map-container-{}" class="inline-leaflet-map" \
-                    ></div>\n'.format(self.id)
-        result += '<script type=\"text/javascript\">\n'
-        result += "$(document).on('ready', function() {\n"
-        result += self.map_initialization()
-        for mm in self.markers:
-            result += 'L.marker([{},{}]).addTo(leaflet_map_{})' \
-                      '.bindPopup("{}");\n' \
-                      .format(mm['position']['latitude'],
-                              mm['position']['longitude'],
-                              self.id,
-                              mm['message'])
-        result += '});\n'
-        result += '</script>\n\n'
-
-        return result
-
-
+        return ''.join(self.chunks())
+
+
+TABLE_OPENING_TEMPLATE = \
+    '<table>\n<caption>{}</caption>\n<tbody>\n'.format
+
+TABLE_PAGED_OPENING_TEMPLATE = (
+    '<table data-page-prefix="table-{}-" data-pages="{}">\n'
+    '<caption>{}</caption>\n<tbody>\n').format
+
+# Body rows are rendered this many at a time.
+TABLE_BATCH_ROWS = 512
+
+# The markup opening a row, joining its cells and closing it, keyed by
+# whether the row is the header row; the first cell of each row is
+# special.
+TABLE_ROW_MARKUP = {
+    header: ('<tr>\n<{} class="special">'.format(label),
+             '</{0}>\n<{0}>'.format(label),
+             '</{}>\n</tr>\n'.format(label))
+    for header, label in [(True, 'th'), (False, 'td')]}
+
+TABLE_EMPTY_ROW = '<tr>\n</tr>\n'
+
+TABLE_CLOSING = '</tbody>\n</table>\n'
+
+# The names of the JSON sidecars of paged tables.
+TABLE_SIDECAR = re.compile(r'table-\d+-\d+\.json$')
+
+# Appends the rows of a paged table from its JSON sidecars, a page each
+# time its button is pressed.
+TABLE_LOADER = (
+    '<script type="text/javascript">\n'
+    "$(document).on('ready', function() {\n"
+    "$('table[data-pages]').each(function() {\n"
+    'var table = $(this);\n'
+    "var prefix = table.attr('data-page-prefix');\n"
+    "var pages = parseInt(table.attr('data-pages'), 10);\n"
+    'var next = 1;\n'
+    "var button = $('<button type=\"button\" class=\"table-more\">"
+    "Show more rows</button>');\n"
+    "button.on('click', function() {\n"
+    "$.getJSON(prefix + next + '.json', function(rows) {\n"
+    "var body = table.children('tbody');\n"
+    'rows.forEach(function(row) {\n'
+    "var tr = $('<tr>');\n"
+    'row.forEach(function(cell, index) {\n'
+    "var td = $('<td>').html(cell);\n"
+    "if (index === 0) { td.addClass('special'); }\n"
+    'tr.append(td);\n'
+    '});\n'
+    'body.append(tr);\n'
+    '});\n'
+    'next += 1;\n'
+    'if (next > pages) { button.remove(); }\n'
+    '});\n'
+    '});\n'
+    'table.after(button);\n'
+    '});\n'
+    '});\n'
+    '</script>\n')
+
+
+def table_rows(rows, header=False):
+    '''
+    Yield the markup for rows, TABLE_BATCH_ROWS rows at a time.
+
+    The markup for a row is decided once, by whether it is the header
+    row, and each batch is rendered with a single join. With header,
+    the first row is the header row.
+    '''
+    rows = iter(rows)
+    if header:
+        for row in itertools.islice(rows, 1):
+            opening, separator, closing = TABLE_ROW_MARKUP[True]
+            yield opening + separator.join(map(str, row)) + closing \
+                if row else TABLE_EMPTY_ROW
+    opening, separator, closing = TABLE_ROW_MARKUP[False]
+    while True:
+        batch = list(itertools.islice(rows, TABLE_BATCH_ROWS))
+        if not batch:
+            return
+        yield ''.join([opening + separator.join(map(str, row)) + closing
+                       if row else TABLE_EMPTY_ROW
+                       for row in batch])
+
+
+@register_element(
+    ['table'],
+    lambda data, article: Table(data, article.next_table_id(), article))
 class Table:
-    article = None
+    __slots__ = ('article', 'id', 'title', 'contents')
 
-    def __init__(self, data, article):
+    def __init__(self, data, id, article):
         self.article = article
+        self.id = id
         self.title = data['title']
         self.contents = data['contents']
 
-    def output(self):
-        result = '<table>\n'
-        result += '<caption>{}</caption>\n'.format(self.title)
-        result += '<tbody>\n'
-        first_row = True
-        for row in self.contents:
-            result += '<tr>\n'
-
-            if first_row:
-                cell_label = 'th'
-                first_row = False
-            else:
-                cell_label = 'td'
-
-            first_cell = True
-            for cell in row:
-                if first_cell:
-                    cell_class = ' class="special"'
-                else:
-                    cell_class = ''
-
-                result += '<{}{}>{}</{}>\n'.format(
-                    cell_label,
-                    cell_class,
-                    cell,
-                    cell_label)
-                first_cell = False
+    def chunks(self):
+        page_rows = self.article.table_page_rows
+        # The header row is always in the page.
+        if not page_rows or len(self.contents) <= page_rows + 1:
+            yield TABLE_OPENING_TEMPLATE(self.title)
+            yield from table_rows(self.contents, header=True)
+            yield TABLE_CLOSING
+            return
+
+        # The first page of body rows stays in the page, and each later
+        # page goes to a sidecar, table-{id}-{page}.json.
+        body = self.contents[page_rows + 1:]
+        pages = 0
+        for start in range(0, len(body), page_rows):
+            pages += 1
+            self.article.sidecars.append((
+                'table-{}-{}.json'.format(self.id, pages),
+                body[start:start + page_rows]))
+
+        yield TABLE_PAGED_OPENING_TEMPLATE(self.id, pages, self.title)
+        yield from table_rows(self.contents[:page_rows + 1], header=True)
+        yield TABLE_CLOSING
 
-            result += '</tr>\n'
+    def output(self):
+        return ''.join(self.chunks())
 
-        result += '</tbody>\n'
-        result += '</table>\n'
 
-        return result
+GALLERY_ITEM_TEMPLATE = compile_template(
+    '--><li data-caption="{caption}" data-credit="{credit}">'
+    '<a class="fancybox" rel="{group}" '
+    'title="{caption}<span class=\'credit\'>{credit}</span>" '
+    'href="{prefix}large-{url}">'
+    '<img src="{prefix}thumb-{url}" width="100" alt="{alt}" />'
+    '</a></li><!--',
+    'caption', 'credit', 'group', 'prefix', 'url', 'alt')
 
 
+@register_element(['anvil-gallery'])
 class ImageGallery:
-    article = None
-    group_id = None
-    images = []
+    __slots__ = ('article', 'group', 'images')
 
     def __init__(self, data, article):
         self.article = article
@@ -309,42 +846,49 @@ class ImageGallery:
         for image in data['images']:
             self.images.append(Image(image, self.article))
 
+    def chunks(self):
+        yield '<ul class="image-gallery"><!--'
+        prefix = self.article.image_prefix
+        for batch in batches(self.images):
+            yield ''.join([GALLERY_ITEM_TEMPLATE(
+                               image.caption, image.credit, self.group,
+                               prefix, image.url_template, image.alt)
+                           for image in batch])
+        yield '--></ul>'
+
     def output(self):
-        result = '<ul class="image-gallery"><!--'
-        for image in self.images:
-            result += '--><li data-caption="{}" data-credit="{}">'.format(
-                image.caption, image.credit)
-            result += '<a class="fancybox" rel="{}" '.format(self.group) + \
-                'title="{}<span class=\'credit\'>{}</span>" '.format(image.caption, image.credit) + \
-                'href="/images/issues/{}/{}/large-{}">'.format(
-                    self.article.volume, self.article.number,
-                    image.url_template)
-            result += '<img src="/images/issues/{}/{}/thumb-{}" ' \
-                .format(self.article.volume, self.article.number, image.url_template) + \
-                'width="100" alt="{}" />'.format(image.alt)
-            result += '</a></li><!--'
+        return ''.join(self.chunks())
 
-        result += '--></ul>'
 
-        return result
+IMAGE_TEMPLATE = compile_template(
+    '{opening}'
+    '<a class="fancybox" href="{prefix}large-{url}">\n'
+    '<img src="{prefix}medium-{url}" alt="{alt}" />\n'
+    '</a>\n'
+    '{caption}'
+    '</div>',
+    'opening', 'prefix', 'url', 'alt', 'caption')
+IMAGE_CAPTION_TEMPLATE = '<p class="caption">\n{}{}</p>\n'.format
+IMAGE_CREDIT_TEMPLATE = '<span class="credit">{}</span>\n'.format
 
 
+@register_element(['image'])
 class Image:
-    article = None
-    url_template = None
-    alt = None
-    caption = None
-    credit = None
-    float_left = None
-    alt_voice = None
+    __slots__ = ('article', 'url_template', 'alt', 'caption', 'credit',
+                 'float_left', 'alt_voice')
 
     def __init__(self, data, article):
+        self.alt = None
+        self.caption = None
+        self.credit = None
+        self.float_left = None
+        self.alt_voice = None
         if 'alt' in data:
             self.alt = data['alt']
         if 'caption' in data:
-            self.caption = markdown.markdown(data['caption'])[3:-4]
+            self.caption = rendering.render(data['caption'])
         if 'credit' in data:
-            self.credit = markdown.markdown(data['credit'])[3:-4]
+            self.credit = rendering.render(data['credit'])
         if 'float' in data:
             self.float_left = True
         if 'alt-voice' in data:
@@ -354,119 +898,279 @@ class Image:
 
         self.article = article
 
-    def output(self):
+    def chunks(self):
         if self.float_left:
-            result = '<div class="float-image left">'
+            opening = '<div class="float-image left">'
         elif self.alt_voice:
-            result = '<div class="alternate-voice inline-image">'
+            opening = '<div class="alternate-voice inline-image">'
         else:
-            result = '<div class="inline-image">\n'
-
-        result += \
-            '<a class="fancybox" href="/images/issues/{}/{}/large-{}">\n' \
-            .format(self.article.volume, self.article.number,
-                    self.url_template)
-        result += \
-            '<img src="/images/issues/{}/{}/medium-{}" ' \
-            'alt="{}" />\n' \
-            .format(self.article.volume, self.article.number,
-                    self.url_template, self.alt)
-        result += '</a>\n'
-
-        caption_condition = self.caption and len(self.caption) > 0
-        credit_condition = self.credit and len(self.credit) > 0
-
-        if caption_condition or credit_condition:
-            result += '<p class="caption">\n'
-            if caption_condition:
-                result += self.caption + '\n'
-            if credit_condition:
-                result += \
-                    '<span class="credit">{}</span>\n'.format(self.credit)
-            result += '</p>\n'
-        result += '</div>'
-
-        return result
+            opening = '<div class="inline-image">\n'
+
+        caption = ''
+        if self.caption or self.credit:
+            caption = IMAGE_CAPTION_TEMPLATE(
+                self.caption + '\n' if self.caption else '',
+                IMAGE_CREDIT_TEMPLATE(self.credit) if self.credit else '')
+
+        yield IMAGE_TEMPLATE(opening, self.article.image_prefix,
+                             self.url_template, self.alt, caption)
+
+    def output(self):
+        return ''.join(self.chunks())
+
 
+DIVIDERS = {'major-divider': '<hr class="special" />',
+            'minor-divider': '<hr />'}
 
+
+@register_element(DIVIDERS)
 class Divider:
-    article = None
-    style = None
+    __slots__ = ('article', 'style')
 
     def __init__(self, data, article):
         self.style = data['type']
         self.article = article
 
     def output(self):
-        if self.style == 'major-divider':
-            result = '<hr class="special" />'
-        elif self.style == 'minor-divider':
-            result = '<hr />'
-        else:
-            result = ''
+        return DIVIDERS.get(self.style, '')
 
-        return result
+    def chunks(self):
+        yield self.output()
 
 
+HEADER_TEMPLATES = {'major': '<h3>{}</h3>'.format,
+                    'minor': '<h5>{}</h5>'.format}
+
+
+@register_element(['major-header', 'minor-header'])
 class Header:
-    article = None
-    style = None
-    content = None
+    __slots__ = ('article', 'style', 'content')
 
     def __init__(self, data, article):
         self.article = article
+        self.style = None
         if data['type'] == 'major-header':
             self.style = 'major'
         elif data['type'] == 'minor-header':
             self.style = 'minor'
-        self.content = markdown.markdown(data['content'])[3:-4]
+        self.content = rendering.render(data['content'])
 
     def output(self):
-        if self.style == 'major':
-            result = '<h3>{}</h3>'.format(self.content)
-        elif self.style == 'minor':
-            result = '<h5>{}</h5>'.format(self.content)
-
-        return result
-
-
-class ContentFile:
-    '''Representation of production content file in Appendix JSON format.'''
-    stream = None
-    content = None
-
-    def __init__(self, stream):
-        self.stream = stream
-        self.content = json.loads(self.stream.read())
+        return HEADER_TEMPLATES[self.style](self.content)
+
+    def chunks(self):
+        yield self.output()
+
+
+def build_article(path, volume, number, directory='.', streaming=False,
+                  consolidate_maps=False, table_page_rows=None):
+    '''
+    Parse, build and write the article in the content file at path.
+
+    Returns the paths written, the article's warnings and its link
+    index entry.
+    '''
+    start = time.perf_counter()
+    markdown_calls = profiler.counts.get('markdown calls', 0)
+
+    article = Article(load(path, streaming), volume, number,
+                      consolidate_maps, table_page_rows)
+    outputs = article.output(directory)
+
+    profiler.record_article(
+        article.short_reference,
+        seconds=time.perf_counter() - start,
+        markdown_calls=profiler.counts.get('markdown calls', 0) -
+        markdown_calls)
+    return outputs, article.warnings(), article.index_entry()
+
+
+def format_counts(counts):
+    return ', '.join('{} ({})'.format(name, n)
+                     for name, n in sorted(counts.items()))
+
+
+def positive_int(value):
+    '''Parse a command line value which must be a positive integer.'''
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            'must be a positive integer: {!r}'.format(value))
+    return number
+
+
+def initialize_worker(renderer_options, profiler_options, cache_options):
+    '''Configure a worker process as its parent was configured.'''
+    rendering.configure(**renderer_options)
+    content_file.configure_cache(**cache_options)
+    profiler.configure(**profiler_options)
+
+
+def run_job(function, path, *args):
+    '''
+    Run function(path, *args) for one content file in a worker.
+
+    Returns a dict with the path, function's result, or None if it
+    raised, the error or None, and the markdown cache counters and
+    profile figures for the job.
+    '''
+    before = rendering.renderer.stats()
+    profiler.reset()
+    result = None
+    try:
+        with profiler.profiled():
+            result = function(path, *args)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    after = rendering.renderer.stats()
+    counters = {key: after[key] - before[key]
+                for key in ['hits', 'misses', 'disk_hits']}
+    return {'path': path,
+            'result': result,
+            'error': error,
+            'counters': counters,
+            'profile': profiler.snapshot()}
+
+
+def _build_article_job(job):
+    '''
+    Run build_article in a worker.
+
+    Returns run_job's dict, with the paths written, any warnings and the
+    article's link index entry in place of the result.
+    '''
+    job_result = run_job(build_article, *job)
+    outputs, warnings, index_entry = job_result.pop('result') or \
+        ([], [], None)
+    job_result.update(outputs=outputs, warnings=warnings,
+                      index_entry=index_entry)
+    return job_result
 
 
 if __name__ == '__main__':
-    content_files = []
-    skipped_names = [
-        'contributors', 'cover.jpg', 'bundle.json',
-        'cover-chapter-1.jpg', 'cover-chapter-2.jpg',
-        'cover-chapter-3.jpg']
-    issue = None
-    number = None
-
-    for idx, arg in enumerate(sys.argv):
-        # Expects 3+ command line arguments:
-        # volume number
-        # issue number
-        # path(s) to JSON files for article content
-        if idx == 0:
-            pass
-        elif idx == 1:
-            issue = arg
-        elif idx == 2:
-            number = arg
-        else:
-            name = arg.split('/')[-1]
-            if name not in skipped_names:
-                content_files.append(ContentFile(open(arg)))
-
-    current_directory = os.getcwd()
-    for file in content_files:
-        os.chdir(current_directory)
-        article = Article(file, issue, number)
-        article.output()
+    parser = argparse.ArgumentParser(
+        description='Generate web content for an issue.')
+    parser.add_argument('volume', help='volume number')
+    parser.add_argument('number', help='issue number')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='path(s) to JSON files for article content')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--markdown-cache', metavar='DIRECTORY',
+                        help='directory for the on-disk markdown cache')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='report markdown cache hits and misses')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip articles whose content file and '
+                        'generator are unchanged since the last build')
+    parser.add_argument('--stream', action='store_true',
+                        help='read content files incrementally (needs '
+                        'ijson) to keep memory flat on huge documents')
+    parser.add_argument('--consolidate-maps', action='store_true',
+                        help='write all of an article\'s maps as one JSON '
+                        'data island with a single initializer script')
+    parser.add_argument('--table-page-rows', type=positive_int,
+                        metavar='N',
+                        help='keep only the first N body rows of larger '
+                        'tables in the page, and write the rest to JSON '
+                        'sidecar files of N rows each')
+    parser.add_argument('--link-index', metavar='FILE',
+                        help='keep an index of every article and anchor '
+                        'built in FILE and report internal links that '
+                        'do not resolve against it')
+    content_file.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    renderer_options = {'cache_directory': args.markdown_cache}
+    rendering.configure(**renderer_options)
+    cache_options = content_file.configure(args)
+    instrumentation.configure(args)
+
+    directory = os.getcwd()
+    paths = content_paths(args.paths)
+
+    digests = {}
+    if args.incremental:
+        import build_manifest
+
+        manifest = build_manifest.BuildManifest(
+            os.path.join(directory,
+                         'issue-{}-{}'.format(args.volume, args.number)),
+            'web_format',
+            build_manifest.generator_version(
+                __file__, rendering.__file__, map_clusters.__file__,
+                content_file.__file__) +
+            ('-consolidated-maps' if args.consolidate_maps else '') +
+            ('-table-pages-{}'.format(args.table_page_rows)
+             if args.table_page_rows else ''))
+        for path in paths:
+            try:
+                digests[path] = build_manifest.file_digest(path)
+            except OSError:
+                # Left for the build to report.
+                digests[path] = None
+        unchanged = [path for path in paths
+                     if manifest.is_current(path, digests[path])]
+        paths = [path for path in paths if path not in unchanged]
+        if unchanged:
+            sys.stderr.write(
+                '{} unchanged files skipped\n'.format(len(unchanged)))
+
+    jobs = [(path, args.volume, args.number, directory, args.stream,
+             args.consolidate_maps, args.table_page_rows)
+            for path in paths]
+
+    if args.jobs > 1:
+        import multiprocessing
+
+        with multiprocessing.Pool(
+                args.jobs, initialize_worker,
+                (renderer_options, profiler.options(),
+                 cache_options)) as pool:
+            # imap keeps results in input order, so reporting is
+            # deterministic regardless of which worker finishes first.
+            results = list(pool.imap(_build_article_job, jobs))
+    else:
+        results = [_build_article_job(job) for job in jobs]
+
+    failed = 0
+    totals = {'hits': 0, 'misses': 0, 'disk_hits': 0}
+    run_profile = instrumentation.Profiler()
+    for result in results:
+        path = result['path']
+        if result['error']:
+            failed += 1
+            sys.stderr.write('{}: failed\n{}'.format(path, result['error']))
+        elif args.incremental:
+            manifest.record(path, digests[path], result['outputs'])
+        for warning in result['warnings']:
+            sys.stderr.write('{}: {}\n'.format(path, warning))
+        for key in totals:
+            totals[key] += result['counters'][key]
+        run_profile.merge(result['profile'])
+
+    if args.incremental:
+        manifest.save()
+
+    if args.link_index:
+        import link_index
+
+        link_index.report_broken_links(
+            link_index.LinkIndex(args.link_index),
+            [(result['path'], result['index_entry']) for result in results
+             if result['index_entry']],
+            sys.stderr)
+
+    if args.cache_stats:
+        sys.stderr.write(
+            'markdown cache: {hits} hits, {misses} misses '
+            '({disk_hits} served from disk)\n'.format(**totals))
+
+    if profiler.enabled:
+        sys.stderr.write(run_profile.summary())
+
+    if failed:
+        sys.stderr.write('{} of {} files failed\n'.format(failed, len(jobs)))
+        sys.exit(1)